@@ -0,0 +1,38 @@
+"""Repository key epoch
+
+Revision ID: 7f3b5c81d0e2
+Revises: e41c7d2a9b06
+Create Date: 2026-10-18 20:14:51.730296
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "7f3b5c81d0e2"
+down_revision: Union[str, None] = "e41c7d2a9b06"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a constant default is stored in the catalog, existing rows aren't
+    # rewritten
+    op.add_column(
+        "repositories",
+        sa.Column("key_epoch", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.add_column(
+        "repositories",
+        sa.Column("previous_key", sa.Text(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("repositories", "previous_key")
+    op.drop_column("repositories", "key_epoch")
@@ -0,0 +1,39 @@
+"""Repository owner index
+
+Revision ID: a5cb5e1fb295
+Revises: bdfec70d10b7
+Create Date: 2026-10-18 19:41:03.527114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a5cb5e1fb295"
+down_revision: Union[str, None] = "bdfec70d10b7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # lists a user's repositories by id, see bdfec70d10b7 for CONCURRENTLY
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_repositories_owner_id",
+            "repositories",
+            ["owner_id", "id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_repositories_owner_id",
+            table_name="repositories",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,53 @@
+"""Env and version indexes
+
+Revision ID: bdfec70d10b7
+Revises: 9da1d436c0d3
+Create Date: 2026-10-18 19:40:12.118204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "bdfec70d10b7"
+down_revision: Union[str, None] = "9da1d436c0d3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name, table, columns, unique
+indexes = [
+    ("ix_envs_repository_stage_key", "envs", ["repository_id", "stage", "key"], True),
+    (
+        "ix_versions_repository_version",
+        "versions",
+        ["repository_id", sa.text("version_number DESC")],
+        True,
+    ),
+    ("ix_envs_created_by", "envs", ["created_by"], False),
+    ("ix_versions_created_by", "versions", ["created_by"], False),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY can't run inside a transaction. A failed build leaves an
+    # INVALID index behind, drop it before running this again.
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in indexes:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=unique,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(indexes):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,43 @@
+"""Sealed env values
+
+Revision ID: e41c7d2a9b06
+Revises: a5cb5e1fb295
+Create Date: 2026-10-18 19:52:37.402915
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "e41c7d2a9b06"
+down_revision: Union[str, None] = "a5cb5e1fb295"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a sealed value is base64 of its header, nonce, ciphertext and tag, it
+    # outgrows the 1000 characters its plaintext is limited to. varchar to
+    # text only changes the catalog in postgres, the table isn't rewritten.
+    op.alter_column(
+        "envs",
+        "value",
+        existing_type=sa.String(length=1000),
+        type_=sa.Text(),
+        existing_nullable=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column(
+        "envs",
+        "value",
+        existing_type=sa.Text(),
+        type_=sa.String(length=1000),
+        existing_nullable=False,
+    )
@@ -0,0 +1,52 @@
+"""
+Micro-benchmark of the session encodings stored in redis.
+
+    python -m benchmarks.session_codec
+"""
+
+import timeit
+from server.types import GitHubUser, GithubAuthToken, UserSession
+
+N = 50_000
+
+session = UserSession(
+    device_type="web",
+    user=GitHubUser(
+        id=12345678,
+        name="Test User",
+        login="testuser",
+        type="User",
+        avatar_url="https://avatars.githubusercontent.com/u/12345678?v=4",
+    ),
+    gh_token=GithubAuthToken(
+        access_token="gho_" + "x" * 36,
+        token_type="bearer",
+        scope="read:user,repo",
+    ),
+    csrf_token="f" * 64,
+)
+
+
+def bench(name: str, stmt, size: int):
+    usec = timeit.timeit(stmt, number=N) / N * 1e6
+    print(f"{name:<24}{usec:>10.2f} us{size:>12} bytes")
+
+
+if __name__ == "__main__":
+    flat = session.make_flat_map()
+    # what HGETALL hands back: every value as a string
+    flat_str = {k: str(v) for k, v in flat.items()}
+    flat_size = sum(len(k) + len(str(v)) for k, v in flat.items())
+
+    def from_hash():
+        m = dict(flat_str)
+        m["user.id"] = int(m["user.id"])
+        UserSession.from_flat_map(m)
+
+    blob = session.encode()
+
+    print(f"{'':<24}{'time/op':>13}{'payload':>18}")
+    bench("hash encode", session.make_flat_map, flat_size)
+    bench("hash decode", from_hash, flat_size)
+    bench("binary encode", session.encode, len(blob))
+    bench("binary decode", lambda: UserSession.decode(blob), len(blob))
@@ -1,104 +1,765 @@
-from redis import Redis
+import asyncio
+import hashlib
+import json
+import math
+import secrets
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import AsyncIterator
+from redis.asyncio import BlockingConnectionPool, Redis, RedisCluster, Sentinel
+from redis.asyncio.client import Pipeline
+from redis.asyncio.cluster import ClusterPipeline
+from redis.exceptions import RedisError
 from loguru import logger
 from fastapi import HTTPException, status
-from .config import REDIS_HOST, REDIS_PORT_DEFAULT
-from .types import UserSession
-
-
-_redis = Redis(REDIS_HOST, port=REDIS_PORT_DEFAULT, decode_responses=True)
-
-_redis.ping()
-logger.info("Connected to redis")
-
-
-def create_user_session(
+from .config import (
+    REDIS_MODE,
+    REDIS_HOST,
+    REDIS_PORT_DEFAULT,
+    REDIS_SENTINELS,
+    REDIS_SENTINEL_SERVICE,
+    REDIS_POOL_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+    EVAULT_SESSION_CACHE_SIZE,
+    EVAULT_SESSION_CACHE_TTL,
+    EVAULT_REPO_CACHE_SIZE,
+    EVAULT_REPO_CACHE_TTL,
+    EVAULT_REPO_CACHE_REDIS_TTL,
+    EVAULT_USER_PROFILE_TTL,
+)
+from .lru import TTLCache
+from .types import RepositoryInfo, RotationProgress, SessionInfo, UserSession
+
+type RedisPipeline = Pipeline | ClusterPipeline
+
+_CLUSTER = REDIS_MODE == "cluster"
+
+# connections are opened lazily by the pool, on first use, from the event loop
+# running the app. hiredis is picked up automatically for response parsing.
+# responses are raw bytes since sessions are stored in a binary encoding.
+_sentinel: Sentinel | None = None
+_redis: Redis | RedisCluster
+if REDIS_MODE == "cluster":
+    _redis = RedisCluster(
+        host=REDIS_HOST,
+        port=REDIS_PORT_DEFAULT,
+        max_connections=REDIS_POOL_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        decode_responses=False,
+    )
+elif REDIS_MODE == "sentinel":
+    # the master is looked up again on failover, stale connections are dropped
+    _sentinel = Sentinel(REDIS_SENTINELS, socket_timeout=REDIS_SOCKET_TIMEOUT)
+    _redis = _sentinel.master_for(
+        REDIS_SENTINEL_SERVICE,
+        max_connections=REDIS_POOL_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        decode_responses=False,
+    )
+else:
+    _redis = Redis(
+        connection_pool=BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT_DEFAULT,
+            max_connections=REDIS_POOL_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            decode_responses=False,
+        )
+    )
+
+# EXPIRE doubles as the existence check: it returns 0 when the key is gone, so
+# checking, extending and reading the session is a single round trip.
+# sessions written before the binary encoding are hashes, those are returned
+# flattened and tagged so they can still be decoded until they expire.
+_FETCH_SESSION_SCRIPT = """
+if redis.call("EXPIRE", KEYS[1], ARGV[1]) == 0 then
+    return nil
+end
+if redis.call("TYPE", KEYS[1]).ok == "hash" then
+    return {"hash", redis.call("HGETALL", KEYS[1])}
+end
+return {"string", redis.call("GET", KEYS[1])}
+"""
+_fetch_session = _redis.register_script(_FETCH_SESSION_SCRIPT)
+
+# sliding window log: the key is a sorted set of request timestamps (ms, redis
+# clock, so every worker agrees). returns 0 and records the request if it fits
+# in the window, otherwise the ms until the oldest request leaves the window.
+_RATE_LIMIT_SCRIPT = """
+local t = redis.call("TIME")
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local window = tonumber(ARGV[1])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - window)
+if redis.call("ZCARD", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("ZADD", KEYS[1], now, ARGV[3])
+    redis.call("PEXPIRE", KEYS[1], window)
+    return 0
+end
+local oldest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+return math.max(1, tonumber(oldest[2]) + window - now)
+"""
+_rate_limit = _redis.register_script(_RATE_LIMIT_SCRIPT)
+
+# a key rotation's lock holds its worker's token: only that worker extends
+# the lock and saves progress, a worker that lost the lock stops.
+_SAVE_ROTATION_SCRIPT = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call("PEXPIRE", KEYS[1], ARGV[2])
+redis.call("SET", KEYS[2], ARGV[3], "EX", ARGV[4])
+return 1
+"""
+_save_rotation = _redis.register_script(_SAVE_ROTATION_SCRIPT)
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+_release_lock = _redis.register_script(_RELEASE_LOCK_SCRIPT)
+# progress is kept for a week after a rotation's last batch
+_ROTATION_PROGRESS_TTL = 7 * 24 * 3600
+
+# every worker subscribes to this channel, to drop revoked sessions from its
+# own in-process cache and to wake up requests waiting on a login.
+# messages are "<kind>:<id>".
+_EVENTS_CHANNEL = "evault-events"
+
+# events of the running cluster pipelines, by pipeline id, see `_publish`
+_pending_events: dict[int, list[str]] = {}
+
+# long-polling logins, by session id, woken up by a "token-poll" event
+# every waiter has an event of its own, a session can be polled concurrently
+_token_waiters: dict[str, set[asyncio.Event]] = {}
+
+_sessions: TTLCache[str, UserSession] | None = None
+if EVAULT_SESSION_CACHE_SIZE > 0:
+    _sessions = TTLCache(EVAULT_SESSION_CACHE_SIZE, EVAULT_SESSION_CACHE_TTL)
+
+_repositories: TTLCache[int, RepositoryInfo] | None = None
+if EVAULT_REPO_CACHE_SIZE > 0:
+    _repositories = TTLCache(EVAULT_REPO_CACHE_SIZE, EVAULT_REPO_CACHE_TTL)
+
+
+async def ping():
+    await _redis.ping()
+
+
+async def close():
+    if isinstance(_redis, RedisCluster):
+        await _redis.aclose()
+    else:
+        await _redis.aclose(close_connection_pool=True)
+
+
+async def listen_events():
+    """
+    Handles the events published by every worker: drops invalidated entries
+    from the in-process caches and wakes up waiting logins. Runs until
+    cancelled, resubscribing if the connection drops.
+    """
+    while True:
+        subscriber: Redis | None = None
+        try:
+            subscriber = await _make_subscriber()
+            async with subscriber.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(_EVENTS_CHANNEL)
+                # anything published while unsubscribed was missed
+                if _sessions is not None:
+                    _sessions.clear()
+                if _repositories is not None:
+                    _repositories.clear()
+                for events in _token_waiters.values():
+                    for event in events:
+                        event.set()
+
+                async for message in pubsub.listen():
+                    _handle_event(message["data"])
+        except RedisError as e:
+            logger.warning(f"Event listener disconnected: {e}")
+            await asyncio.sleep(1)
+        finally:
+            if subscriber is not None:
+                await subscriber.aclose(close_connection_pool=True)
+
+
+@asynccontextmanager
+async def batch(transaction: bool = True) -> AsyncIterator[RedisPipeline]:
+    """
+    Queues the commands issued on the yielded pipeline and sends them in one
+    round trip when the block exits, wrapped in MULTI/EXEC unless
+    `transaction` is False. Nothing is sent if the block raises. In cluster
+    mode batches are never transactional, and their events are published
+    right after them, see `_pipeline` and `_publish`.
+
+    The write helpers below take an optional `pipe` to join a batch:
+
+        async with cache.batch() as pipe:
+            await cache.create_user_session(token, session, ttl, pipe)
+            await cache.cache_token_poll(session_id, token, ttl, pipe)
+    """
+    async with _pipeline(transaction) as pipe:
+        yield pipe
+        await pipe.execute()
+
+
+def session_cache_stats() -> dict[str, int | float] | None:
+    if _sessions is None:
+        return None
+
+    return _sessions.stats()
+
+
+def repository_cache_stats() -> dict[str, int | float] | None:
+    if _repositories is None:
+        return None
+
+    return _repositories.stats()
+
+
+async def create_user_session(
     evault_access_token: str,
     user_session: UserSession,
     ttl: int,
+    pipe: RedisPipeline | None = None,
 ):
-    key = _make_session_key(evault_access_token)
-    data = user_session.make_flat_map()
-    _redis.hset(name=key, mapping=data)
-    _redis.expire(key, ttl)
+    """
+    Stores the session and adds it to the user's session index, atomically
+    unless `pipe` is a non transactional batch.
+    """
+    if pipe is None:
+        async with batch() as pipe:
+            await create_user_session(evault_access_token, user_session, ttl, pipe)
+        return
 
+    key = _make_session_key(evault_access_token)
+    index = _make_user_sessions_key(user_session.user.id)
+    await pipe.set(name=key, value=user_session.encode(), ex=ttl)
+    await pipe.zadd(index, {evault_access_token: int(time.time())})
+
+
+async def fetch_user_session(evault_access_token: str, ttl: int) -> UserSession:
+    """
+    Extends the session by `ttl` seconds and returns it, in one round trip.
+    Sessions found in the in-process cache are returned without touching redis.
+    raises `HTTPException` (440) if the session does not exist.
+    """
+    if _sessions is not None:
+        user_session = _sessions.get(evault_access_token)
+        if user_session is not None:
+            return user_session
 
-def get_user_session(evault_access_token: str) -> UserSession:
     key = _make_session_key(evault_access_token)
-    d = _redis.hgetall(name=key)
-    if d == {}:
+    reply = await _fetch_session(keys=[key], args=[ttl])
+    if not reply:
         raise HTTPException(status_code=440, detail="Session expired.")
 
-    m = {}
-    for key, val in d.items():
-        m[key] = val
+    user_session = _decode_user_session(*reply)
+    if _sessions is not None:
+        _sessions.put(evault_access_token, user_session)
 
-    m["user.id"] = int(m["user.id"])
-    return UserSession.from_flat_map(m)
+    return user_session
 
 
-def renew_user_session(evault_access_token: str, ttl: int):
+async def renew_user_session(evault_access_token: str, ttl: int):
     key = _make_session_key(evault_access_token)
-    ctr = _redis.exists(key)
-    if ctr == 0:
+    renewed = await _redis.expire(key, ttl)
+    if not renewed:
         raise HTTPException(status_code=440, detail="Session expired.")
 
-    _redis.expire(key, ttl)
 
+async def cache_token_poll(
+    session_id: str,
+    evault_access_token: str,
+    ttl: int,
+    pipe: RedisPipeline | None = None,
+):
+    if pipe is None:
+        async with batch() as pipe:
+            await cache_token_poll(session_id, evault_access_token, ttl, pipe)
+        return
 
-def cache_token_poll(session_id: str, evault_access_token: str, ttl: int):
-    key = f"evault-token-poll:{session_id}"
-    _redis.set(name=key, value=evault_access_token, ex=ttl)
+    key = _make_token_poll_key(session_id)
+    await pipe.set(name=key, value=evault_access_token, ex=ttl)
+    _publish(pipe, f"token-poll:{session_id}")
 
 
-def get_token_poll(session_id: str) -> str | None:
-    t = _redis.getdel(f"evault-token-poll:{session_id}")
+async def get_token_poll(session_id: str) -> str | None:
+    t = await _redis.getdel(_make_token_poll_key(session_id))
     if t:
-        return t
+        return t.decode()
 
     return None
 
 
-def cache_auth_url(session_id: str, auth_url: str, ttl: int):
+async def wait_token_poll(session_id: str, timeout: float) -> str | None:
+    """
+    Long polling `get_token_poll`: waits up to `timeout` seconds for the token
+    to be issued. No redis connection is held while waiting, the request is
+    woken up by the "token-poll" event `cache_token_poll` publishes.
+    """
+    event = asyncio.Event()
+    waiters = _token_waiters.setdefault(session_id, set())
+    waiters.add(event)
+    try:
+        # the token may have been issued before the waiter was registered
+        token = await get_token_poll(session_id)
+        if token is not None:
+            return token
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except TimeoutError:
+            return None
+
+        return await get_token_poll(session_id)
+    finally:
+        waiters.discard(event)
+        # the last waiter out removes the entry
+        if not waiters and _token_waiters.get(session_id) is waiters:
+            del _token_waiters[session_id]
+
+
+async def cache_auth_url(
+    session_id: str,
+    auth_url: str,
+    ttl: int,
+    pipe: RedisPipeline | None = None,
+):
+    r = _redis if pipe is None else pipe
     key = _make_auth_url_key(session_id)
-    _redis.set(name=key, value=auth_url, ex=ttl)
+    await r.set(name=key, value=auth_url, ex=ttl)
 
 
-def get_auth_url(session_id: str) -> str:
+async def get_auth_url(session_id: str) -> str:
     key = _make_auth_url_key(session_id)
-    t = _redis.get(key)
+    t = await _redis.get(key)
     if not t:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Login link expired.",
         )
 
-    return t
+    return t.decode()
 
 
-def renew_auth_url(session_id: str, ttl: int):
+async def renew_auth_url(session_id: str, ttl: int):
     key = _make_auth_url_key(session_id)
-    a = _redis.expire(key, ttl)
-    print(f"renew auth: {a}")
+    await _redis.expire(key, ttl)
 
 
-def remove_auth_url(session_id: str):
+async def pop_auth_url(session_id: str) -> str:
+    """
+    Reads and removes the login url in one command, so a login link can only
+    be redeemed once.
+    """
     key = _make_auth_url_key(session_id)
-    url_removed = _redis.delete(key)
-    if url_removed != 1:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    t = await _redis.getdel(key)
+    if not t:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Login link expired.",
+        )
+
+    return t.decode()
 
 
-def remove_session(session_id: str):
+async def remove_session(session_id: str, user_id: int):
     key = _make_session_key(session_id)
+    if _sessions is not None:
+        _sessions.pop(session_id)
 
-    session_removed = _redis.delete(key) == 1
-    if not session_removed:
+    async with _pipeline() as pipe:
+        pipe.delete(key)
+        pipe.zrem(_make_user_sessions_key(user_id), session_id)
+        _publish(pipe, f"session:{session_id}")
+        removed = (await pipe.execute())[0]
+
+    if removed != 1:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
 
+async def list_user_sessions(user_id: int) -> list[SessionInfo]:
+    """
+    returns the live sessions of the user, oldest first. Index entries whose
+    session expired are dropped along the way.
+    """
+    index = _make_user_sessions_key(user_id)
+    members = await _redis.zrange(index, 0, -1, withscores=True)
+    if not members:
+        return []
+
+    async with _pipeline(transaction=False) as pipe:
+        for token, _ in members:
+            key = _make_session_key(token.decode())
+            pipe.get(key)
+            pipe.ttl(key)
+        replies = await pipe.execute()
+
+    sessions: list[SessionInfo] = []
+    expired: list[bytes] = []
+    for (token, created_at), data, ttl in zip(members, replies[::2], replies[1::2]):
+        if data is None:
+            expired.append(token)
+            continue
+
+        sessions.append(
+            SessionInfo(
+                id=make_session_id(token.decode()),
+                device_type=UserSession.decode(data).device_type,
+                created_at=int(created_at),
+                expires_in=ttl,
+            )
+        )
+
+    if expired:
+        await _redis.zrem(index, *expired)
+
+    return sessions
+
+
+async def revoke_user_sessions(user_id: int) -> int:
+    """
+    Removes every session of the user, returns how many were still live.
+    """
+    index = _make_user_sessions_key(user_id)
+    tokens = [t.decode() for t in await _redis.zrange(index, 0, -1)]
+    if not tokens:
+        return 0
+
+    if _sessions is not None:
+        for token in tokens:
+            _sessions.pop(token)
+
+    async with _pipeline() as pipe:
+        for token in tokens:
+            pipe.delete(_make_session_key(token))
+        # sessions created after the ZRANGE above stay indexed
+        pipe.zrem(index, *tokens)
+        for token in tokens:
+            _publish(pipe, f"session:{token}")
+        replies = await pipe.execute()
+
+    return sum(replies[: len(tokens)])
+
+
+async def prune_user_sessions(user_id: int):
+    """
+    Drops index entries whose session expired. The index itself never
+    expires since sessions slide, it is pruned on login, list and revoke.
+    """
+    index = _make_user_sessions_key(user_id)
+    tokens = await _redis.zrange(index, 0, -1)
+    if not tokens:
+        return
+
+    async with _pipeline(transaction=False) as pipe:
+        for token in tokens:
+            pipe.exists(_make_session_key(token.decode()))
+        alive = await pipe.execute()
+
+    expired = [t for t, n in zip(tokens, alive) if n == 0]
+    if expired:
+        await _redis.zrem(index, *expired)
+
+
+async def hit_rate_limit(bucket: str, limit: int, window: float) -> float:
+    """
+    Records a request against `bucket`, allowing `limit` requests per sliding
+    `window` seconds, in one round trip. returns 0 if the request is allowed,
+    otherwise how many seconds until it would be.
+    """
+    key = f"evault-ratelimit:{_tag(bucket)}"
+    retry_after_ms = await _rate_limit(
+        keys=[key],
+        args=[int(window * 1000), limit, secrets.token_hex(8)],
+    )
+    return retry_after_ms / 1000
+
+
+async def get_repository_info(repo_id: int) -> RepositoryInfo | None:
+    """
+    returns the cached repository metadata, from the in-process cache or
+    redis, None if neither has it.
+    """
+    if _repositories is not None:
+        info = _repositories.get(repo_id)
+        if info is not None:
+            return info
+
+    raw = await _redis.get(_make_repository_key(repo_id))
+    if raw is None:
+        return None
+
+    info = RepositoryInfo(**json.loads(raw))
+    if _repositories is not None:
+        _repositories.put(repo_id, info)
+
+    return info
+
+
+async def cache_repository_info(info: RepositoryInfo):
+    await _redis.set(
+        _make_repository_key(info.id),
+        json.dumps(asdict(info)),
+        ex=EVAULT_REPO_CACHE_REDIS_TTL,
+    )
+    if _repositories is not None:
+        _repositories.put(info.id, info)
+
+
+async def invalidate_repository(repo_id: int):
+    """
+    Drops the repository's metadata from redis and from every worker's
+    in-process cache. Call it after anything that changes the repository.
+    """
+    if _repositories is not None:
+        _repositories.pop(repo_id)
+
+    async with _pipeline(transaction=False) as pipe:
+        pipe.delete(_make_repository_key(repo_id))
+        _publish(pipe, f"repo:{repo_id}")
+        await pipe.execute()
+
+
+async def acquire_rotation_lock(repo_id: int, ttl: float) -> str | None:
+    """
+    returns the lock's token, None if another worker is rotating the
+    repository's key.
+    """
+    token = secrets.token_hex(16)
+    acquired = await _redis.set(
+        _make_rotation_lock_key(repo_id), token, nx=True, px=int(ttl * 1000)
+    )
+    return token if acquired else None
+
+
+async def save_rotation_progress(
+    repo_id: int,
+    token: str,
+    progress: RotationProgress,
+    ttl: float,
+) -> bool:
+    """
+    Saves the progress and extends the lock by `ttl` seconds, in one round
+    trip. returns False, saving nothing, if the lock was lost.
+    """
+    saved = await _save_rotation(
+        keys=[_make_rotation_lock_key(repo_id), _make_rotation_key(repo_id)],
+        args=[
+            token,
+            int(ttl * 1000),
+            json.dumps(asdict(progress)),
+            _ROTATION_PROGRESS_TTL,
+        ],
+    )
+    return saved == 1
+
+
+async def release_rotation_lock(repo_id: int, token: str):
+    await _release_lock(keys=[_make_rotation_lock_key(repo_id)], args=[token])
+
+
+async def get_rotation_progress(repo_id: int) -> RotationProgress | None:
+    raw = await _redis.get(_make_rotation_key(repo_id))
+    if raw is None:
+        return None
+
+    return RotationProgress(**json.loads(raw))
+
+
+async def revoke_unlock_token(repo_id: int, jti: str, ttl: float):
+    """
+    Revokes one unlock token, remembered until it would have expired anyway.
+    """
+    await _redis.set(
+        _make_unlock_revoked_key(repo_id, jti), 1, ex=max(1, math.ceil(ttl))
+    )
+
+
+async def revoke_unlock_tokens(repo_id: int, before: int, ttl: float):
+    """
+    Revokes every unlock token of the repository issued up to `before` (unix
+    seconds), remembered for `ttl` seconds, the longest a token lives.
+    """
+    await _redis.set(_make_unlock_not_before_key(repo_id), before, ex=math.ceil(ttl))
+
+
+async def unlock_token_revoked(repo_id: int, jti: str, issued_at: int) -> bool:
+    # both keys share the repository's slot, one round trip in every mode
+    revoked, not_before = await _redis.mget(
+        _make_unlock_revoked_key(repo_id, jti),
+        _make_unlock_not_before_key(repo_id),
+    )
+    return revoked is not None or (
+        not_before is not None and issued_at <= int(not_before)
+    )
+
+
+async def user_profile_matches(user_id: int, fingerprint: str) -> bool:
+    """
+    returns whether `fingerprint` is the last profile stored for the user.
+    """
+    stored = await _redis.get(_make_user_profile_key(user_id))
+    return stored is not None and stored.decode() == fingerprint
+
+
+async def cache_user_profile(user_id: int, fingerprint: str):
+    await _redis.set(
+        _make_user_profile_key(user_id),
+        fingerprint,
+        ex=EVAULT_USER_PROFILE_TTL,
+    )
+
+
+def make_session_id(evault_access_token: str) -> str:
+    """
+    A stable, non secret identifier of a session, safe to hand to clients.
+    """
+    return hashlib.sha256(evault_access_token.encode()).hexdigest()[:16]
+
+
+@asynccontextmanager
+async def _pipeline(transaction: bool = True) -> AsyncIterator[RedisPipeline]:
+    # cluster transactions must stay within one hash slot, while the writes
+    # that go together here (session, user index) span several. each command
+    # is still atomic on its own, and a session is always written with its
+    # expiry, so a partial batch never leaves an immortal key behind.
+    async with _redis.pipeline(transaction=transaction and not _CLUSTER) as pipe:
+        try:
+            yield pipe
+        finally:
+            events = _pending_events.pop(id(pipe), None)
+
+    if events:
+        # the async cluster client has no publish(), the command is routed by
+        # the channel's slot and broadcast cluster-wide from there
+        await asyncio.gather(
+            *(_redis.execute_command("PUBLISH", _EVENTS_CHANNEL, e) for e in events)
+        )
+
+
+def _publish(pipe: RedisPipeline, event: str):
+    """
+    Publishes `event` on the events channel along with the pipeline's
+    commands. Cluster pipelines refuse PUBLISH: there it is sent right after
+    the pipeline, once its block exits without raising.
+    """
+    if _CLUSTER:
+        _pending_events.setdefault(id(pipe), []).append(event)
+    else:
+        pipe.publish(_EVENTS_CHANNEL, event)
+
+
+async def _make_subscriber() -> Redis:
+    """
+    A dedicated connection for pub/sub. It blocks on reads indefinitely, so
+    it cannot come from the shared pool and its socket timeout: an idle
+    listener would time out, resubscribe and clear the caches every few
+    seconds. Dead connections are caught by the health checks instead.
+    """
+    if isinstance(_redis, RedisCluster):
+        # classic pub/sub is broadcast cluster-wide, any node will do
+        await _redis.initialize()
+        node = _redis.get_default_node()
+        return Redis(
+            host=node.host,
+            port=node.port,
+            socket_timeout=None,
+            health_check_interval=30,
+        )
+
+    if _sentinel is not None:
+        # master_for passes the sentinel's socket timeout on to every
+        # connection unless overridden
+        return _sentinel.master_for(
+            REDIS_SENTINEL_SERVICE,
+            socket_timeout=None,
+            health_check_interval=30,
+        )
+
+    return Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT_DEFAULT,
+        socket_timeout=None,
+        health_check_interval=30,
+    )
+
+
+def _handle_event(message: bytes):
+    kind, _, key = message.decode().partition(":")
+    if kind == "session" and _sessions is not None:
+        _sessions.pop(key)
+    elif kind == "token-poll":
+        for event in _token_waiters.get(key, ()):
+            event.set()
+    elif kind == "repo" and _repositories is not None:
+        _repositories.pop(int(key))
+
+
+def _decode_user_session(kind: bytes, payload: bytes | list[bytes]) -> UserSession:
+    try:
+        if kind == b"string":
+            return UserSession.decode(payload)
+
+        # legacy hash sessions, stored as a flat map with dotted keys
+        m: dict[str, int | str] = {
+            k.decode(): v.decode() for k, v in zip(payload[::2], payload[1::2])
+        }
+        m["user.id"] = int(m["user.id"])
+        return UserSession.from_flat_map(m)
+    except (ValueError, KeyError):
+        logger.warning("Discarding undecodable session")
+        raise HTTPException(status_code=440, detail="Session expired.")
+
+
+def _tag(key_id: str | int) -> str:
+    # in cluster mode ids are wrapped in a hash tag, so every key of the same
+    # id (e.g. the login url and token poll of one login flow) share a slot.
+    # other modes keep the plain names, and the sessions already stored.
+    return f"{{{key_id}}}" if _CLUSTER else f"{key_id}"
+
+
 def _make_session_key(session_id: str) -> str:
-    return f"evault-session:{session_id}"
+    return f"evault-session:{_tag(session_id)}"
+
+
+def _make_user_sessions_key(user_id: int) -> str:
+    return f"evault-user-sessions:{_tag(user_id)}"
 
 
 def _make_auth_url_key(session_id: str) -> str:
-    return f"evault-auth:{session_id}"
+    return f"evault-auth:{_tag(session_id)}"
+
+
+def _make_token_poll_key(session_id: str) -> str:
+    return f"evault-token-poll:{_tag(session_id)}"
+
+
+def _make_repository_key(repo_id: int) -> str:
+    return f"evault-repository:{_tag(repo_id)}"
+
+
+def _make_user_profile_key(user_id: int) -> str:
+    return f"evault-user-profile:{_tag(user_id)}"
+
+
+def _make_rotation_key(repo_id: int) -> str:
+    return f"evault-rotation:{_tag(repo_id)}"
+
+
+def _make_rotation_lock_key(repo_id: int) -> str:
+    return f"evault-rotation-lock:{_tag(repo_id)}"
+
+
+def _make_unlock_revoked_key(repo_id: int, jti: str) -> str:
+    return f"evault-unlock-revoked:{_tag(repo_id)}:{jti}"
+
+
+def _make_unlock_not_before_key(repo_id: int) -> str:
+    return f"evault-unlock-not-before:{_tag(repo_id)}"
@@ -1,6 +1,6 @@
 import dotenv
 import os
-from .utils import env_or_default
+from .utils import env_or_default, parse_rate
 
 dotenv.load_dotenv()
 
@@ -17,10 +17,99 @@ EVAULT_SESSION_TOKEN_TTL = (
 EVAULT_WEB_URL = env_or_default("EVAULT_WEB_URL", "http://localhost:5173")
 EVAULT_TOKEN_POLL_TTL = 30
 EVAULT_TOKEN_POLL_MAX_ATTEMPT = 10
+EVAULT_TOKEN_POLL_WAIT = 25  # long polling window, in seconds
 EVAULT_DEBUG: bool = env_or_default("EVAULT_DEBUG", "0").lower() == "1"
+# how long a worker waits for redis and postgres at startup, in seconds, and
+# how many times each is tried. a worker starts anyway once either runs out.
+EVAULT_STARTUP_BUDGET = float(env_or_default("EVAULT_STARTUP_BUDGET", "10"))
+EVAULT_STARTUP_ATTEMPTS = int(env_or_default("EVAULT_STARTUP_ATTEMPTS", "6"))
+# in-process cache of decoded sessions in front of redis, 0 disables it. a
+# cached session skips redis entirely, so its ttl is only extended once every
+# EVAULT_SESSION_CACHE_TTL seconds.
+EVAULT_SESSION_CACHE_SIZE = int(env_or_default("EVAULT_SESSION_CACHE_SIZE", "1024"))
+EVAULT_SESSION_CACHE_TTL = float(env_or_default("EVAULT_SESSION_CACHE_TTL", "5"))
+# repository metadata, cached in redis for EVAULT_REPO_CACHE_REDIS_TTL seconds
+# and in-process for EVAULT_REPO_CACHE_TTL, 0 disables the in-process cache.
+# writes invalidate both.
+EVAULT_REPO_CACHE_SIZE = int(env_or_default("EVAULT_REPO_CACHE_SIZE", "1024"))
+EVAULT_REPO_CACHE_TTL = float(env_or_default("EVAULT_REPO_CACHE_TTL", "60"))
+EVAULT_REPO_CACHE_REDIS_TTL = 3600
+# a login whose github profile matches the one seen within this many seconds
+# skips the users upsert entirely.
+EVAULT_USER_PROFILE_TTL = 86400
+# sliding window rate limits, "<requests>/<seconds>". auth is limited per
+# client ip, the dashboard per user, and creating a repository (argon2 + a
+# github call) has its own, tighter, limit.
+EVAULT_RATE_LIMIT_AUTH = parse_rate(env_or_default("EVAULT_RATE_LIMIT_AUTH", "30/60"))
+EVAULT_RATE_LIMIT_DASHBOARD = parse_rate(
+    env_or_default("EVAULT_RATE_LIMIT_DASHBOARD", "120/60")
+)
+EVAULT_RATE_LIMIT_NEW_REPOSITORY = parse_rate(
+    env_or_default("EVAULT_RATE_LIMIT_NEW_REPOSITORY", "5/60")
+)
+EVAULT_RATE_LIMIT_KEY_ROTATION = parse_rate(
+    env_or_default("EVAULT_RATE_LIMIT_KEY_ROTATION", "5/3600")
+)
+# most variables a single push may carry, values are at most 1000 characters.
+EVAULT_PUSH_MAX_KEYS = int(env_or_default("EVAULT_PUSH_MAX_KEYS", "1000"))
+EVAULT_ENV_VALUE_MAX_LENGTH = 1000
+# versions are stored as deltas against the stage's previous version, with a
+# full snapshot every EVAULT_SNAPSHOT_INTERVAL versions of the stage.
+EVAULT_SNAPSHOT_INTERVAL = int(env_or_default("EVAULT_SNAPSHOT_INTERVAL", "10"))
+assert EVAULT_SNAPSHOT_INTERVAL > 0
+# page sizes of the listing endpoints.
+EVAULT_PAGE_SIZE_DEFAULT = 50
+EVAULT_PAGE_SIZE_MAX = 200
+# where version payloads are stored, content addressed.
+EVAULT_BLOB_BACKEND = env_or_default("EVAULT_BLOB_BACKEND", "local")
+assert EVAULT_BLOB_BACKEND in ("local",)
+EVAULT_BLOB_DIR = env_or_default("EVAULT_BLOB_DIR", "./data/blobs")
+# the server half of every repository key, hex encoded. repository keys can't
+# be derived, so encrypted pushes and pulls fail, unless this is set.
+EVAULT_SERVER_SECRET = os.environ.get("EVAULT_SERVER_SECRET")
+# derived repository keys kept in memory, per worker.
+EVAULT_KEYRING_SIZE = int(env_or_default("EVAULT_KEYRING_SIZE", "256"))
+EVAULT_KEYRING_TTL = float(env_or_default("EVAULT_KEYRING_TTL", "300"))
+# unlock tokens let pulls skip the repository password, for at most this many
+# seconds.
+EVAULT_UNLOCK_TOKEN_TTL = int(env_or_default("EVAULT_UNLOCK_TOKEN_TTL", "900"))
+# key rotations re-seal EVAULT_ROTATION_BATCH_SIZE variables, or version
+# payloads, per batch, pausing EVAULT_ROTATION_BATCH_DELAY seconds in between.
+EVAULT_ROTATION_BATCH_SIZE = int(env_or_default("EVAULT_ROTATION_BATCH_SIZE", "100"))
+EVAULT_ROTATION_BATCH_DELAY = float(
+    env_or_default("EVAULT_ROTATION_BATCH_DELAY", "0.5")
+)
+# argon2 runs in a process pool of EVAULT_HASH_WORKERS per worker, each hash
+# takes 64 MiB. at most EVAULT_HASH_QUEUE_MAX more requests wait for a free
+# process, further ones get a 503.
+EVAULT_HASH_WORKERS = int(env_or_default("EVAULT_HASH_WORKERS", "2"))
+EVAULT_HASH_QUEUE_MAX = int(env_or_default("EVAULT_HASH_QUEUE_MAX", "32"))
+# the /api/internal routes are disabled unless this is set.
+EVAULT_INTERNAL_TOKEN = os.environ.get("EVAULT_INTERNAL_TOKEN")
 
+# standalone: a single node at REDIS_HOST.
+# sentinel: the master of REDIS_SENTINEL_SERVICE, discovered through
+#   REDIS_SENTINELS ("host:port,host:port").
+# cluster: a redis cluster, REDIS_HOST is used as the startup node.
+REDIS_MODE = env_or_default("REDIS_MODE", "standalone")
+assert REDIS_MODE in ("standalone", "sentinel", "cluster")
 REDIS_HOST = env_or_default("REDIS_HOST", "localhost")
 REDIS_PORT_DEFAULT = 6379
+REDIS_SENTINELS = [
+    (host, int(port))
+    for host, _, port in (
+        node.partition(":")
+        for node in env_or_default("REDIS_SENTINELS", "localhost:26379").split(",")
+    )
+]
+REDIS_SENTINEL_SERVICE = env_or_default("REDIS_SENTINEL_SERVICE", "mymaster")
+# the pool is shared by every request handled by a worker, callers wait up to
+# REDIS_POOL_TIMEOUT seconds for a free connection instead of failing outright.
+# in sentinel and cluster modes callers do not wait, and the cluster limit is
+# per node.
+REDIS_POOL_MAX_CONNECTIONS = int(env_or_default("REDIS_POOL_MAX_CONNECTIONS", "64"))
+REDIS_POOL_TIMEOUT = int(env_or_default("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(env_or_default("REDIS_SOCKET_TIMEOUT", "5"))
 
 PSQL_USER = os.environ["POSTGRES_USER"]
 PSQL_PASSWORD = os.environ["POSTGRES_PASSWORD"]
@@ -29,3 +118,17 @@ PSQL_PORT = env_or_default("POSTGRES_PORT", "5432")
 PSQL_DBNAME = os.environ["POSTGRES_DBNAME"]
 PSQL_SSLMODE = env_or_default("POSTGRES_SSL", "require")
 assert PSQL_SSLMODE == "require" or PSQL_SSLMODE == "disable"
+# connection pool, per worker. every worker may open up to
+# PSQL_POOL_SIZE + PSQL_POOL_MAX_OVERFLOW connections, keep
+# workers * (size + overflow) under postgres' max_connections.
+PSQL_POOL_SIZE = int(env_or_default("POSTGRES_POOL_SIZE", "5"))
+PSQL_POOL_MAX_OVERFLOW = int(env_or_default("POSTGRES_POOL_MAX_OVERFLOW", "10"))
+PSQL_POOL_TIMEOUT = float(env_or_default("POSTGRES_POOL_TIMEOUT", "30"))
+PSQL_POOL_RECYCLE = int(env_or_default("POSTGRES_POOL_RECYCLE", "1800"))
+PSQL_POOL_PRE_PING: bool = env_or_default("POSTGRES_POOL_PRE_PING", "1") == "1"
+# optional streaming replica for reads, same credentials and database. reads
+# go to the primary while the replica is down or more than
+# PSQL_REPLICA_MAX_LAG seconds behind.
+PSQL_REPLICA_HOST = os.environ.get("POSTGRES_REPLICA_HOST")
+PSQL_REPLICA_PORT = env_or_default("POSTGRES_REPLICA_PORT", PSQL_PORT)
+PSQL_REPLICA_MAX_LAG = float(env_or_default("POSTGRES_REPLICA_MAX_LAG", "5"))
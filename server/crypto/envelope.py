@@ -0,0 +1,365 @@
+import base64
+import binascii
+import secrets
+from typing import AsyncIterable, AsyncIterator, Mapping
+from blake3 import blake3
+from Crypto.Cipher import AES
+from .keyring import wiping, zeroize
+
+_FORMAT_VERSION = 1
+_NONCE_LENGTH = 12
+_TAG_LENGTH = 16
+# format version and key epoch, authenticated along with the ciphertext
+_HEADER_LENGTH = 1 + 4
+
+# a keyed hash of the payload's digest, its segments' key is derived from it
+_STREAM_SALT_LENGTH = 16
+_STREAM_SEGMENT_SIZE = 64 * 1024
+
+_VALUES_CONTEXT = "evault 2069-04-20 00:04:20 envelope values v1"
+_STREAM_CONTEXT = "evault 2069-04-20 00:04:20 envelope stream v1"
+_STREAM_SALT_CONTEXT = "evault 2069-04-20 00:04:20 envelope stream salt v1"
+_WRAP_CONTEXT = "evault 2069-04-20 00:04:20 envelope key wrap v1"
+
+# repository keys by epoch: opening takes every key a repository may have
+# sealed with, the current and, during a rotation, the previous one
+type Keys = Mapping[int, bytes | bytearray]
+
+
+class EnvelopeError(ValueError):
+    """
+    A sealed value or stream is malformed, was tampered with, or was sealed
+    with another key.
+    """
+
+
+def _data_key(repo_key: bytes | bytearray, context: str) -> bytearray:
+    # pylint: disable=E1102
+    return bytearray(blake3(repo_key, derive_key_context=context).digest())
+
+
+def _header(epoch: int) -> bytes:
+    return _FORMAT_VERSION.to_bytes(1) + epoch.to_bytes(4)
+
+
+def _parse_header(raw: bytes | bytearray) -> int:
+    if len(raw) < _HEADER_LENGTH or raw[0] != _FORMAT_VERSION:
+        raise EnvelopeError("unknown format")
+
+    return int.from_bytes(raw[1:_HEADER_LENGTH])
+
+
+class _DataKeys:
+    """
+    The data keys of `keys` for one context, derived on first use and
+    zeroized on exit.
+    """
+
+    def __init__(self, keys: Keys, context: str):
+        self._keys = keys
+        self._context = context
+        self._derived: dict[int, bytearray] = {}
+
+    def __enter__(self) -> "_DataKeys":
+        return self
+
+    def __exit__(self, *_):
+        for data_key in self._derived.values():
+            zeroize(data_key)
+
+    def get(self, epoch: int) -> bytearray:
+        data_key = self._derived.get(epoch)
+        if data_key is None:
+            if epoch not in self._keys:
+                raise EnvelopeError(f"no key for epoch {epoch}")
+            data_key = _data_key(self._keys[epoch], self._context)
+            self._derived[epoch] = data_key
+
+        return data_key
+
+
+def _context(repo_id: int, stage: str) -> bytes:
+    stage_bytes = stage.encode()
+    return repo_id.to_bytes(8) + len(stage_bytes).to_bytes(2) + stage_bytes
+
+
+def seal_envs(
+    repo_key: bytes | bytearray,
+    epoch: int,
+    repo_id: int,
+    stage: str,
+    variables: Mapping[str, str],
+) -> dict[str, str]:
+    """
+    Encrypts every value of a stage with AES-256-GCM, under one data key
+    derived from the repository key and a fresh nonce per value. The
+    repository, stage and variable name are authenticated with each value, so
+    a sealed value can't be moved to another variable.
+
+    returns the sealed values, base64 text: version, epoch, nonce, ciphertext
+    and tag.
+    """
+    header = _header(epoch)
+    prefix = header + _context(repo_id, stage)
+    nonces = secrets.token_bytes(_NONCE_LENGTH * len(variables))
+    sealed: dict[str, str] = {}
+
+    with wiping(_data_key(repo_key, _VALUES_CONTEXT)) as data_key:
+        for i, (key, value) in enumerate(variables.items()):
+            nonce = nonces[i * _NONCE_LENGTH : (i + 1) * _NONCE_LENGTH]
+            cipher = AES.new(data_key, AES.MODE_GCM, nonce=nonce)
+            cipher.update(prefix + key.encode())
+            ciphertext, tag = cipher.encrypt_and_digest(value.encode())
+            sealed[key] = base64.b64encode(header + nonce + ciphertext + tag).decode()
+
+    return sealed
+
+
+def open_envs(
+    keys: Keys,
+    repo_id: int,
+    stage: str,
+    sealed: Mapping[str, str],
+) -> dict[str, str]:
+    """
+    The inverse of `seal_envs`, opening every value with the key of the epoch
+    it was sealed at. raises EnvelopeError if any value fails to authenticate
+    or was sealed at an epoch missing from `keys`.
+    """
+    context = _context(repo_id, stage)
+    body_start = _HEADER_LENGTH + _NONCE_LENGTH
+    variables: dict[str, str] = {}
+
+    with _DataKeys(keys, _VALUES_CONTEXT) as data_keys:
+        for key, value in sealed.items():
+            try:
+                raw = base64.b64decode(value, validate=True)
+            except binascii.Error:
+                raise EnvelopeError(f"'{key}' is not a sealed value")
+
+            if len(raw) < body_start + _TAG_LENGTH:
+                raise EnvelopeError(f"'{key}' is too short")
+
+            data_key = data_keys.get(_parse_header(raw))
+            cipher = AES.new(
+                data_key, AES.MODE_GCM, nonce=raw[_HEADER_LENGTH:body_start]
+            )
+            cipher.update(raw[:_HEADER_LENGTH] + context + key.encode())
+            try:
+                plaintext = cipher.decrypt_and_verify(
+                    raw[body_start:-_TAG_LENGTH], raw[-_TAG_LENGTH:]
+                )
+                variables[key] = plaintext.decode()
+            except (ValueError, UnicodeDecodeError):
+                raise EnvelopeError(f"'{key}' failed to authenticate")
+
+    return variables
+
+
+def sealed_epoch(sealed: str) -> int:
+    """
+    returns the key epoch a value was sealed at, raises EnvelopeError if it
+    isn't a sealed value.
+    """
+    try:
+        return _parse_header(base64.b64decode(sealed[:8], validate=True))
+    except binascii.Error:
+        raise EnvelopeError("not a sealed value")
+
+
+def stream_epoch(head: bytes) -> int:
+    """
+    returns the key epoch a stream was sealed at, from its first bytes.
+    raises EnvelopeError if it isn't a sealed stream.
+    """
+    return _parse_header(head)
+
+
+def wrap_key(
+    repo_key: bytes | bytearray,
+    epoch: int,
+    repo_id: int,
+    key: bytes | bytearray,
+) -> str:
+    """
+    Seals another key, e.g. the previous epoch's during a rotation, under the
+    repository key. returns base64 text like `seal_envs`.
+    """
+    nonce = secrets.token_bytes(_NONCE_LENGTH)
+    header = _header(epoch)
+    with wiping(_data_key(repo_key, _WRAP_CONTEXT)) as data_key:
+        cipher = AES.new(data_key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header + repo_id.to_bytes(8))
+        ciphertext, tag = cipher.encrypt_and_digest(bytes(key))
+
+    return base64.b64encode(header + nonce + ciphertext + tag).decode()
+
+
+def unwrap_key(
+    repo_key: bytes | bytearray,
+    epoch: int,
+    repo_id: int,
+    wrapped: str,
+) -> bytearray:
+    """
+    The inverse of `wrap_key`, raises EnvelopeError if it fails to
+    authenticate.
+    """
+    try:
+        raw = base64.b64decode(wrapped, validate=True)
+    except binascii.Error:
+        raise EnvelopeError("not a wrapped key")
+
+    body_start = _HEADER_LENGTH + _NONCE_LENGTH
+    if len(raw) < body_start + _TAG_LENGTH or _parse_header(raw) != epoch:
+        raise EnvelopeError("unknown format or epoch")
+
+    with wiping(_data_key(repo_key, _WRAP_CONTEXT)) as data_key:
+        cipher = AES.new(data_key, AES.MODE_GCM, nonce=raw[_HEADER_LENGTH:body_start])
+        cipher.update(raw[:_HEADER_LENGTH] + repo_id.to_bytes(8))
+        try:
+            return bytearray(
+                cipher.decrypt_and_verify(
+                    raw[body_start:-_TAG_LENGTH], raw[-_TAG_LENGTH:]
+                )
+            )
+        except ValueError:
+            raise EnvelopeError("wrapped key failed to authenticate")
+
+
+def _segment_key(data_key: bytes | bytearray, salt: bytes) -> bytes:
+    # pylint: disable=E1102
+    return blake3(salt, key=data_key).digest()
+
+
+def _segment_cipher(
+    segment_key: bytearray,
+    counter: int,
+    last: bool,
+    aad: bytes,
+):
+    if counter >= 1 << 32:
+        raise EnvelopeError("stream too long")
+
+    # every payload has a key of its own, the nonce only tells its segments
+    # apart: 7 zero bytes, 4 bytes of index and 1 byte of last flag
+    nonce = bytes(7) + counter.to_bytes(4) + (b"\x01" if last else b"\x00")
+    cipher = AES.new(segment_key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(aad)
+    return cipher
+
+
+async def seal_stream(
+    repo_key: bytes | bytearray,
+    epoch: int,
+    repo_id: int,
+    stage: str,
+    chunks: AsyncIterable[bytes],
+    digest: bytes,
+) -> AsyncIterator[bytes]:
+    """
+    Encrypts a payload in 64 KiB segments (the STREAM construction): each
+    segment is sealed with AES-256-GCM under a nonce made of its index and
+    whether it is the last one, so segments can't be dropped, reordered or
+    truncated away.
+
+    Sealing is deterministic for a repository key: the segments' key is
+    derived from a keyed hash of the stage and `digest`, the payload's blake3
+    digest, kept in the header. The same payload seals to the same blob,
+    which the blob store then keeps once, and without the key two blobs only
+    tell whether they are equal.
+
+    Yields the header (version, epoch, salt) and then every sealed segment.
+    raises EnvelopeError before the last segment if `chunks` don't match
+    `digest`, two payloads must never share a key.
+    """
+    context = _context(repo_id, stage)
+    with wiping(_data_key(repo_key, _STREAM_SALT_CONTEXT)) as salt_key:
+        # pylint: disable=E1102
+        salt = blake3(context + digest, key=salt_key).digest(length=_STREAM_SALT_LENGTH)
+
+    header = _header(epoch) + salt
+    aad = header + context
+    # pylint: disable=E1102
+    hasher = blake3()
+    buf = bytearray()
+    counter = 0
+
+    def seal_segment(segment: bytes, last: bool) -> bytes:
+        cipher = _segment_cipher(segment_key, counter, last, aad)
+        ciphertext, tag = cipher.encrypt_and_digest(segment)
+        return ciphertext + tag
+
+    with (
+        wiping(_data_key(repo_key, _STREAM_CONTEXT)) as data_key,
+        wiping(bytearray(_segment_key(data_key, salt))) as segment_key,
+    ):
+        yield header
+        async for chunk in chunks:
+            hasher.update(chunk)
+            buf += chunk
+            # a full segment followed by more data can't be the last one
+            while len(buf) > _STREAM_SEGMENT_SIZE:
+                sealed = seal_segment(bytes(buf[:_STREAM_SEGMENT_SIZE]), False)
+                del buf[:_STREAM_SEGMENT_SIZE]
+                counter += 1
+                yield sealed
+
+        if hasher.digest() != digest:
+            raise EnvelopeError("payload doesn't match its digest")
+
+        # an empty payload still has its (empty) last segment
+        yield seal_segment(bytes(buf), True)
+
+
+async def open_stream(
+    keys: Keys,
+    repo_id: int,
+    stage: str,
+    chunks: AsyncIterable[bytes],
+) -> AsyncIterator[bytes]:
+    """
+    The inverse of `seal_stream`, with the key of the epoch the stream was
+    sealed at. Yields the plaintext segment by segment.
+    raises EnvelopeError as soon as a segment fails to authenticate, or at
+    the end if the stream was truncated.
+    """
+    sealed_size = _STREAM_SEGMENT_SIZE + _TAG_LENGTH
+    header_size = _HEADER_LENGTH + _STREAM_SALT_LENGTH
+    buf = bytearray()
+    aad: bytes | None = None
+    segment_key = bytearray()
+    counter = 0
+
+    def open_segment(segment: bytes, last: bool) -> bytes:
+        cipher = _segment_cipher(segment_key, counter, last, aad)
+        try:
+            return cipher.decrypt_and_verify(
+                segment[:-_TAG_LENGTH], segment[-_TAG_LENGTH:]
+            )
+        except ValueError:
+            raise EnvelopeError(f"segment {counter} failed to authenticate")
+
+    with _DataKeys(keys, _STREAM_CONTEXT) as data_keys, wiping(segment_key):
+        async for chunk in chunks:
+            buf += chunk
+            if aad is None:
+                if len(buf) < header_size:
+                    continue
+                data_key = data_keys.get(_parse_header(buf))
+                salt = bytes(buf[_HEADER_LENGTH:header_size])
+                segment_key[:] = _segment_key(data_key, salt)
+                aad = bytes(buf[:header_size]) + _context(repo_id, stage)
+                del buf[:header_size]
+
+            # a full segment followed by more data can't be the last one
+            while len(buf) > sealed_size:
+                plaintext = open_segment(bytes(buf[:sealed_size]), False)
+                del buf[:sealed_size]
+                counter += 1
+                yield plaintext
+
+        if aad is None or len(buf) < _TAG_LENGTH:
+            raise EnvelopeError("truncated stream")
+
+        yield open_segment(bytes(buf), True)
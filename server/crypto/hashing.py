@@ -0,0 +1,138 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+from fastapi import HTTPException, status
+from loguru import logger
+from ..config import EVAULT_HASH_WORKERS, EVAULT_HASH_QUEUE_MAX
+from . import passwordhash
+
+
+class _HashMetrics:
+    def __init__(self):
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "workers": EVAULT_HASH_WORKERS,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "wait_avg_ms": (
+                self.wait_total / self.completed * 1000 if self.completed else 0.0
+            ),
+            "wait_max_ms": self.wait_max * 1000,
+            "run_avg_ms": (
+                self.run_total / self.completed * 1000 if self.completed else 0.0
+            ),
+        }
+
+
+_metrics = _HashMetrics()
+# one job per process at a time, the rest queue here where it's measured
+_slots = asyncio.Semaphore(EVAULT_HASH_WORKERS)
+# created on first use. spawned, not forked, a forked copy of the running
+# event loop and its threads is not something to hash in.
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=EVAULT_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _pool
+
+
+async def _run[T](fn: Callable[..., T], *args) -> T:
+    if _metrics.waiting >= EVAULT_HASH_QUEUE_MAX:
+        _metrics.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, retry shortly.",
+            headers={"Retry-After": "1"},
+        )
+
+    queued_at = time.perf_counter()
+    _metrics.waiting += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _metrics.waiting -= 1
+
+    started_at = time.perf_counter()
+    _metrics.running += 1
+    completed = False
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_get_pool(), fn, *args)
+        completed = True
+        return result
+    except BrokenProcessPool:
+        # a process died, likely killed for memory: start a fresh pool
+        logger.error("Password hashing pool broke, restarting it")
+        shutdown()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, retry shortly.",
+            headers={"Retry-After": "1"},
+        )
+    finally:
+        _metrics.running -= 1
+        _slots.release()
+        # the averages are over completed hashes only, a broken pool or a
+        # cancelled request would skew them
+        if completed:
+            _metrics.completed += 1
+            waited = started_at - queued_at
+            _metrics.wait_total += waited
+            _metrics.wait_max = max(_metrics.wait_max, waited)
+            _metrics.run_total += time.perf_counter() - started_at
+        else:
+            _metrics.failed += 1
+
+
+async def hash(plaintext_password: str) -> str:
+    """
+    `passwordhash.hash`, off the event loop. raises 503 when too many hashes
+    are already waiting.
+    """
+    return await _run(passwordhash.hash, plaintext_password)
+
+
+async def verify(digest: str, plaintext_password: str) -> bool:
+    """
+    `passwordhash.verify`, off the event loop. raises 503 when too many
+    hashes are already waiting.
+    """
+    return await _run(passwordhash.verify, digest, plaintext_password)
+
+
+def check_needs_rehash(digest: str) -> bool:
+    # only parses the digest, cheap enough for the event loop
+    return passwordhash.check_needs_rehash(digest)
+
+
+def hashing_stats() -> dict[str, int | float]:
+    return _metrics.stats()
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -4,6 +4,8 @@ import sys
 KEY_LENGTH = 32  # 32 bytes = 256 bits
 
 _KDF_CONTEXT_STRING = "evault 2069-04-20 00:04:20 evault key construction v0"
+# keys of rotated repositories, the epoch is part of the key material
+_KDF_CONTEXT_STRING_V1 = "evault 2069-04-20 00:04:20 evault key construction v1"
 
 
 def derive_repo_key(
@@ -11,14 +13,17 @@ def derive_repo_key(
     repo_id: int,
     repo_password: str,
     key_len: int = KEY_LENGTH,
+    epoch: int = 0,
 ) -> bytes:
     int64_bytelen = 8  # 8 bytes == 64 bits integer
-    key_material = (
-        server_secret
-        + repo_id.to_bytes(int64_bytelen, sys.byteorder)
-        + repo_password.encode()
-    )
+    key_material = server_secret + repo_id.to_bytes(int64_bytelen, sys.byteorder)
+    context = _KDF_CONTEXT_STRING
+    # epoch 0 is every repository's key before its first rotation, it stays
+    # on the original construction
+    if epoch > 0:
+        key_material += epoch.to_bytes(int64_bytelen, sys.byteorder)
+        context = _KDF_CONTEXT_STRING_V1
+
+    key_material += repo_password.encode()
     # pylint: disable=E1102
-    return blake3(key_material, derive_key_context=_KDF_CONTEXT_STRING).digest(
-        length=key_len
-    )
+    return blake3(key_material, derive_key_context=context).digest(length=key_len)
@@ -0,0 +1,120 @@
+import hmac
+import secrets
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator
+from blake3 import blake3
+from ..lru import TTLCache
+from .kdf import derive_repo_key
+
+
+def zeroize(buf: bytearray):
+    """Overwrites key material in place."""
+    buf[:] = bytes(len(buf))
+
+
+@contextmanager
+def wiping(buf: bytearray) -> Iterator[bytearray]:
+    """Zeroizes `buf` once the block exits, however it exits."""
+    try:
+        yield buf
+    finally:
+        zeroize(buf)
+
+
+@dataclass(slots=True)
+class _Entry:
+    tag: bytes
+    key: bytearray
+
+
+class Keyring:
+    """
+    Derived repository keys by (repo_id, key epoch), bounded in size and
+    kept for at most `ttl` seconds. Key material only lives in bytearrays,
+    zeroized as soon as an entry is evicted.
+
+    An entry also holds a tag of the password it was derived from, keyed with
+    a per-process secret, so a hit proves the caller knows the password and
+    can skip both the Argon2 check and the derivation. Every key handed out
+    is a copy the caller owns and should zeroize, see `wiping`, since the
+    cached one may be evicted while the caller still uses it.
+    """
+
+    def __init__(
+        self,
+        server_secret: bytes,
+        maxsize: int,
+        ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self._server_secret = server_secret
+        self.hits = 0
+        self.misses = 0
+        self._tag_key = secrets.token_bytes(32)
+        self._entries: TTLCache[tuple[int, int], _Entry] = TTLCache(
+            maxsize,
+            ttl,
+            on_evict=lambda _, entry: zeroize(entry.key),
+            timer=timer,
+        )
+
+    def get(self, repo_id: int, epoch: int, password: str) -> bytearray | None:
+        """
+        returns a copy of the cached key, None if there is none or it was
+        derived from another password.
+        """
+        entry = self._entries.get((repo_id, epoch))
+        if entry is None or not hmac.compare_digest(
+            entry.tag, self._tag(repo_id, epoch, password)
+        ):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return bytearray(entry.key)
+
+    def derive(self, repo_id: int, epoch: int, password: str) -> bytearray:
+        """
+        Derives the key, caches it and returns a copy. Only call it once the
+        password was verified.
+        """
+        key = derive_repo_key(self._server_secret, repo_id, password, epoch=epoch)
+        return self.put(repo_id, epoch, password, bytearray(key))
+
+    def put(
+        self,
+        repo_id: int,
+        epoch: int,
+        password: str,
+        key: bytearray,
+    ) -> bytearray:
+        """
+        Caches a key obtained otherwise, e.g. unwrapped with the key `password`
+        unlocks, taking ownership of `key`. returns a copy.
+        """
+        self._entries.put(
+            (repo_id, epoch),
+            _Entry(self._tag(repo_id, epoch, password), key),
+        )
+        return bytearray(key)
+
+    def forget(self, repo_id: int, epoch: int):
+        self._entries.pop((repo_id, epoch))
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return self._entries.stats() | {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _tag(self, repo_id: int, epoch: int, password: str) -> bytes:
+        data = f"{repo_id}:{epoch}:".encode() + password.encode()
+        # pylint: disable=E1102
+        return blake3(data, key=self._tag_key).digest()
@@ -0,0 +1,237 @@
+import secrets
+import time
+from dataclasses import dataclass
+from blake3 import blake3
+from fastapi import HTTPException, status
+from loguru import logger
+from ..config import EVAULT_SERVER_SECRET, EVAULT_KEYRING_SIZE, EVAULT_KEYRING_TTL
+from ..config import EVAULT_UNLOCK_TOKEN_TTL
+from ..types import RepositoryInfo
+from .. import cache, database as db
+from . import envelope, hashing, tokens
+from .keyring import Keyring, zeroize
+from .tokens import UnlockClaims
+
+_TOKEN_KEY_CONTEXT = "evault 2069-04-20 00:04:20 unlock tokens v1"
+
+# created on first use, fail then if the server secret is missing
+_keyring: Keyring | None = None
+_token_key: bytes | None = None
+
+
+@dataclass(slots=True)
+class RepositoryKeys:
+    """
+    The keys a request unlocked, by epoch: the current one's and, while the
+    repository is rotating, the previous one's. Copies the request owns,
+    zeroized when its `with` block exits.
+    """
+
+    epoch: int
+    keys: dict[int, bytearray]
+
+    @property
+    def current(self) -> bytearray:
+        return self.keys[self.epoch]
+
+    def __enter__(self) -> "RepositoryKeys":
+        return self
+
+    def __exit__(self, *_):
+        self.wipe()
+
+    def wipe(self):
+        for key in self.keys.values():
+            zeroize(key)
+
+
+def get_keyring() -> Keyring:
+    """
+    returns the worker's keyring, raises 503 if `EVAULT_SERVER_SECRET` isn't
+    configured.
+    """
+    global _keyring
+    if _keyring is None:
+        if EVAULT_SERVER_SECRET is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Encryption is not configured.",
+            )
+        _keyring = Keyring(
+            bytes.fromhex(EVAULT_SERVER_SECRET),
+            EVAULT_KEYRING_SIZE,
+            EVAULT_KEYRING_TTL,
+        )
+
+    return _keyring
+
+
+async def unlock(repo: RepositoryInfo, password: str) -> RepositoryKeys:
+    """
+    returns the repository's keys, from the keyring, or derived and unwrapped
+    once the password checks out against its digest. raises 403 on a wrong
+    password.
+    """
+    keyring = get_keyring()
+    epochs = [repo.key_epoch]
+    if repo.rotating:
+        epochs.append(repo.key_epoch - 1)
+
+    keys: dict[int, bytearray] = {}
+    for epoch in epochs:
+        key = keyring.get(repo.id, epoch, password)
+        if key is None:
+            break
+        keys[epoch] = key
+
+    if len(keys) == len(epochs):
+        return RepositoryKeys(repo.key_epoch, keys)
+
+    for key in keys.values():
+        zeroize(key)
+
+    row = await db.get_repository(repo.id)
+    if row is None or not await hashing.verify(row.password, password):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid repository password.",
+        )
+
+    current = keyring.derive(row.id, row.key_epoch, password)
+    unlocked = RepositoryKeys(row.key_epoch, {row.key_epoch: current})
+    if row.previous_key is not None:
+        try:
+            previous = envelope.unwrap_key(
+                unlocked.current, row.key_epoch, row.id, row.previous_key
+            )
+        except envelope.EnvelopeError as e:
+            unlocked.wipe()
+            logger.error(f"Unreadable previous key of {row.id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Repository keys are corrupted.",
+            )
+        unlocked.keys[row.key_epoch - 1] = keyring.put(
+            row.id, row.key_epoch - 1, password, previous
+        )
+
+    return unlocked
+
+
+async def issue_unlock_token(
+    repo: RepositoryInfo,
+    user_id: int,
+    stage: str,
+    password: str,
+    ttl: int,
+) -> tuple[str, UnlockClaims]:
+    """
+    Checks the password once and returns a token, and its claims, that
+    unlocks `stage` for the user for `ttl` seconds, see `unlock_with_token`.
+    raises 403 on a wrong password.
+    """
+    with await unlock(repo, password) as keys:
+        now = int(time.time())
+        claims = UnlockClaims(
+            jti=secrets.token_hex(16),
+            repo_id=repo.id,
+            user_id=user_id,
+            stage=stage,
+            epoch=keys.epoch,
+            issued_at=now,
+            expires_at=now + ttl,
+        )
+        return tokens.seal_token(_get_token_key(), claims, keys.keys), claims
+
+
+async def unlock_with_token(
+    repo: RepositoryInfo,
+    user_id: int,
+    stage: str,
+    token: str,
+) -> RepositoryKeys:
+    """
+    returns the keys an unlock token carries, after a GCM tag check and a
+    revocation lookup. raises 401 if the token is invalid, expired, revoked
+    or predates a key rotation, 403 if it was issued for another scope.
+    """
+    claims, keys = _open_token(token)
+    unlocked = RepositoryKeys(claims.epoch, keys)
+
+    if (claims.repo_id, claims.user_id, claims.stage) != (repo.id, user_id, stage):
+        unlocked.wipe()
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unlock token not valid here.",
+        )
+
+    if claims.epoch != repo.key_epoch or await cache.unlock_token_revoked(
+        repo.id, claims.jti, claims.issued_at
+    ):
+        unlocked.wipe()
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unlock token revoked, unlock again.",
+        )
+
+    return unlocked
+
+
+async def revoke_unlock_token(repo: RepositoryInfo, user_id: int, token: str):
+    """
+    Revokes one of the user's unlock tokens for the repository.
+    """
+    claims, keys = _open_token(token)
+    for key in keys.values():
+        zeroize(key)
+
+    if (claims.repo_id, claims.user_id) != (repo.id, user_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unlock token not valid here.",
+        )
+
+    await cache.revoke_unlock_token(
+        repo.id, claims.jti, claims.expires_at - time.time()
+    )
+
+
+async def revoke_unlock_tokens(repo: RepositoryInfo):
+    """
+    Revokes every unlock token issued for the repository so far.
+    """
+    await cache.revoke_unlock_tokens(repo.id, int(time.time()), EVAULT_UNLOCK_TOKEN_TTL)
+
+
+def _open_token(token: str) -> tuple[UnlockClaims, dict[int, bytearray]]:
+    try:
+        return tokens.open_token(_get_token_key(), token, time.time())
+    except tokens.TokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid unlock token: {e}.",
+        )
+
+
+def _get_token_key() -> bytes:
+    global _token_key
+    if _token_key is None:
+        if EVAULT_SERVER_SECRET is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Encryption is not configured.",
+            )
+        # pylint: disable=E1102
+        _token_key = blake3(
+            bytes.fromhex(EVAULT_SERVER_SECRET),
+            derive_key_context=_TOKEN_KEY_CONTEXT,
+        ).digest()
+
+    return _token_key
+
+
+def keyring_stats() -> dict[str, int | float] | None:
+    if _keyring is None:
+        return None
+
+    return _keyring.stats()
@@ -1,14 +1,37 @@
-import secrets
+import dataclasses
+from argon2.exceptions import InvalidHashError, VerificationError
 from argon2.profiles import RFC_9106_LOW_MEMORY
 from argon2 import PasswordHasher
 
+# stateless and safe to share. this module is also imported by the hashing
+# process pool's workers, keep it free of app imports.
+_hasher = PasswordHasher.from_parameters(
+    dataclasses.replace(RFC_9106_LOW_MEMORY, salt_len=32)
+)
+
 
 def hash(plaintext_password: str) -> str:
     """
     Hashes the plaintext password with a 32 byte salt, using Argon2ID,
     and the RFC_9106_LOW_MEMORY defined parameters.
     """
-    return PasswordHasher.from_parameters(RFC_9106_LOW_MEMORY).hash(
-        plaintext_password,
-        salt=secrets.token_bytes(32),
-    )
+    return _hasher.hash(plaintext_password)
+
+
+def verify(digest: str, plaintext_password: str) -> bool:
+    """
+    returns whether the password matches the digest, False for a malformed
+    digest too.
+    """
+    try:
+        return _hasher.verify(digest, plaintext_password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def check_needs_rehash(digest: str) -> bool:
+    """
+    returns whether the digest was made with other parameters than the
+    current ones, and should be replaced on the next successful verify.
+    """
+    return _hasher.check_needs_rehash(digest)
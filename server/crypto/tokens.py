@@ -0,0 +1,154 @@
+import base64
+import binascii
+import secrets
+import struct
+from dataclasses import dataclass
+from typing import Mapping
+from Crypto.Cipher import AES
+from .keyring import zeroize
+
+_TOKEN_PREFIX = "evu1."
+_TOKEN_VERSION = 1
+# version, jti, repo id, user id, key epoch, issued at, expires at, stage length
+_CLAIMS = struct.Struct(">B16sQQIQQB")
+_CLAIMS_LENGTH = struct.Struct(">H")
+_KEY_ENTRY = struct.Struct(">I32s")  # epoch, key
+_NONCE_LENGTH = 12
+_TAG_LENGTH = 16
+
+
+class TokenError(ValueError):
+    """
+    An unlock token is malformed, forged, or expired.
+    """
+
+
+@dataclass(slots=True)
+class UnlockClaims:
+    """
+    What an unlock token is good for: pulling one stage of one repository,
+    as one user, until `expires_at` (unix seconds), while the repository is
+    still at key `epoch`.
+    """
+
+    jti: str  # hex, the id it is revoked by
+    repo_id: int
+    user_id: int
+    stage: str
+    epoch: int
+    issued_at: int
+    expires_at: int
+
+
+def seal_token(
+    token_key: bytes | bytearray,
+    claims: UnlockClaims,
+    keys: Mapping[int, bytes | bytearray],
+) -> str:
+    """
+    returns an unlock token: the claims in the clear, and the repository
+    keys by epoch sealed with AES-256-GCM under the server's token key, the
+    claims being its associated data. Checking a token is then a single GCM
+    tag check, no password hash involved.
+    """
+    stage = claims.stage.encode()
+    header = _CLAIMS.pack(
+        _TOKEN_VERSION,
+        bytes.fromhex(claims.jti),
+        claims.repo_id,
+        claims.user_id,
+        claims.epoch,
+        claims.issued_at,
+        claims.expires_at,
+        len(stage),
+    )
+    header = _CLAIMS_LENGTH.pack(len(header) + len(stage)) + header + stage
+
+    plaintext = bytearray()
+    try:
+        for epoch, key in keys.items():
+            plaintext += _KEY_ENTRY.pack(epoch, bytes(key))
+
+        nonce = secrets.token_bytes(_NONCE_LENGTH)
+        cipher = AES.new(token_key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header)
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+    finally:
+        zeroize(plaintext)
+
+    token = header + nonce + ciphertext + tag
+    return _TOKEN_PREFIX + base64.urlsafe_b64encode(token).rstrip(b"=").decode()
+
+
+def open_token(
+    token_key: bytes | bytearray,
+    token: str,
+    now: float,
+) -> tuple[UnlockClaims, dict[int, bytearray]]:
+    """
+    The inverse of `seal_token`. returns the claims and the repository keys
+    by epoch, keys the caller owns and should zeroize. raises TokenError if
+    the token doesn't authenticate or expired at `now`.
+    """
+    if not token.startswith(_TOKEN_PREFIX):
+        raise TokenError("not an unlock token")
+
+    encoded = token[len(_TOKEN_PREFIX) :]
+    try:
+        raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except (binascii.Error, ValueError):
+        raise TokenError("not an unlock token")
+
+    if len(raw) < _CLAIMS_LENGTH.size:
+        raise TokenError("truncated token")
+
+    (header_length,) = _CLAIMS_LENGTH.unpack_from(raw)
+    body_start = _CLAIMS_LENGTH.size + header_length
+    if (
+        header_length < _CLAIMS.size
+        or len(raw) < body_start + _NONCE_LENGTH + _TAG_LENGTH
+    ):
+        raise TokenError("truncated token")
+
+    header = raw[:body_start]
+    version, jti, repo_id, user_id, epoch, issued_at, expires_at, stage_length = (
+        _CLAIMS.unpack_from(raw, _CLAIMS_LENGTH.size)
+    )
+    if version != _TOKEN_VERSION or _CLAIMS.size + stage_length != header_length:
+        raise TokenError("unsupported token")
+    # rejecting needs no authentication, expired tokens skip the crypto
+    if now >= expires_at:
+        raise TokenError("expired token")
+
+    nonce = raw[body_start : body_start + _NONCE_LENGTH]
+    cipher = AES.new(token_key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(header)
+    try:
+        plaintext = bytearray(
+            cipher.decrypt_and_verify(
+                raw[body_start + _NONCE_LENGTH : -_TAG_LENGTH], raw[-_TAG_LENGTH:]
+            )
+        )
+    except ValueError:
+        raise TokenError("forged token")
+
+    try:
+        if len(plaintext) % _KEY_ENTRY.size != 0:
+            raise TokenError("malformed token")
+        keys = {
+            key_epoch: bytearray(key)
+            for key_epoch, key in _KEY_ENTRY.iter_unpack(plaintext)
+        }
+    finally:
+        zeroize(plaintext)
+
+    claims = UnlockClaims(
+        jti=jti.hex(),
+        repo_id=repo_id,
+        user_id=user_id,
+        stage=header[_CLAIMS_LENGTH.size + _CLAIMS.size :].decode(),
+        epoch=epoch,
+        issued_at=issued_at,
+        expires_at=expires_at,
+    )
+    return claims, keys
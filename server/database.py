@@ -1,11 +1,30 @@
-from typing import Literal
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterator, Literal
 from fastapi import HTTPException, status
-import sqlalchemy as sql
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
-from sqlalchemy.dialects.postgresql import insert
-from .models import Repository, User
 from loguru import logger
+import blake3
+import sqlalchemy as sql
+from sqlalchemy.exc import (
+    DBAPIError,
+    IntegrityError,
+    TimeoutError as PoolTimeoutError,
+)
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import defer
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .models import Env, Repository, User, Version
+from .types import RepositoryInfo
+from . import cache
 from .config import (
     PSQL_DBNAME,
     PSQL_HOST,
@@ -13,27 +32,362 @@ from .config import (
     PSQL_USER,
     PSQL_PASSWORD,
     PSQL_SSLMODE,
+    PSQL_POOL_SIZE,
+    PSQL_POOL_MAX_OVERFLOW,
+    PSQL_POOL_TIMEOUT,
+    PSQL_POOL_RECYCLE,
+    PSQL_POOL_PRE_PING,
+    PSQL_REPLICA_HOST,
+    PSQL_REPLICA_PORT,
+    PSQL_REPLICA_MAX_LAG,
     EVAULT_DEBUG,
 )
 
 
 type SSLMode = Literal["require", "disable"]
 
-c = (
-    f"postgresql://{PSQL_USER}:{PSQL_PASSWORD}"
-    f"@{PSQL_HOST}:{PSQL_PORT}/{PSQL_DBNAME}"
-    f"?sslmode={PSQL_SSLMODE}"
-)
-_engine: sql.Engine = sql.create_engine(c, echo=EVAULT_DEBUG)
-logger.info("Connected to database")
 
+# asyncpg takes the ssl mode as a connect argument, not in the url.
+# alembic still migrates through the synchronous psycopg2 driver.
+def _url(host: str, port: str) -> str:
+    return (
+        f"postgresql+asyncpg://{PSQL_USER}:{PSQL_PASSWORD}"
+        f"@{host}:{port}/{PSQL_DBNAME}"
+    )
+
+
+c = _url(PSQL_HOST, PSQL_PORT)
+# created on first use, creating it does not connect either
+_engine: AsyncEngine | None = None
+_sessionmaker: async_sessionmaker[AsyncSession] | None = None
+_replica_engine: AsyncEngine | None = None
+_replica_sessionmaker: async_sessionmaker[AsyncSession] | None = None
+
+# set once the current request wrote, its later reads go to the primary so
+# they see their own writes. every request runs in its own context.
+_read_primary: ContextVar[bool] = ContextVar("read_primary", default=False)
+
+_REPLICA_CHECK_INTERVAL = 1.0  # seconds between lag checks
+_REPLICA_CHECK_TIMEOUT = 1.0  # seconds, connecting included
+# an unreachable replica fails reads over to the primary this fast, instead
+# of after asyncpg's 60s default
+_REPLICA_CONNECT_TIMEOUT = 2.0  # seconds
+# replay lag in seconds, 0 once the replica replayed everything it received:
+# an idle primary sends nothing, that's not lag.
+_REPLICA_LAG_QUERY = sql.text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+""")
+
+
+class _PoolMetrics:
+    """
+    Counters fed by the pool: how long checkouts wait for a connection, how
+    many connections are in use at most, and how often connections are opened.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.in_use = 0
+        self.in_use_peak = 0
+        self.connects = 0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": (
+                self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0
+            ),
+            "wait_max_ms": self.wait_max * 1000,
+            "in_use": self.in_use,
+            "in_use_peak": self.in_use_peak,
+            "connects": self.connects,
+        }
+
+
+_pool_metrics = _PoolMetrics()
+
+
+class _TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Times every checkout, including waiting on a full pool and opening an
+    overflow connection. The pool events only fire once a connection is in
+    hand, so they can't see the wait.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            _pool_metrics.timeouts += 1
+            raise
+        finally:
+            _pool_metrics.record_wait(time.perf_counter() - start)
+
+
+def _on_connect(*_):
+    _pool_metrics.connects += 1
+
+
+def _on_checkout(*_):
+    _pool_metrics.in_use += 1
+    _pool_metrics.in_use_peak = max(_pool_metrics.in_use_peak, _pool_metrics.in_use)
+
+
+def _on_checkin(*_):
+    _pool_metrics.in_use -= 1
+
+
+def _get_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            c,
+            echo=EVAULT_DEBUG,
+            connect_args={"ssl": PSQL_SSLMODE},
+            poolclass=_TimedQueuePool,
+            pool_size=PSQL_POOL_SIZE,
+            max_overflow=PSQL_POOL_MAX_OVERFLOW,
+            pool_timeout=PSQL_POOL_TIMEOUT,
+            pool_recycle=PSQL_POOL_RECYCLE,
+            pool_pre_ping=PSQL_POOL_PRE_PING,
+        )
+        pool = _engine.sync_engine.pool
+        sql.event.listen(pool, "connect", _on_connect)
+        sql.event.listen(pool, "checkout", _on_checkout)
+        sql.event.listen(pool, "checkin", _on_checkin)
+
+    return _engine
+
+
+def _session() -> AsyncSession:
+    """
+    A new session. Objects stay usable after commit, since the handlers read
+    them once the session is closed and can't lazy load in async code.
+    """
+    global _sessionmaker
+    if _sessionmaker is None:
+        _sessionmaker = async_sessionmaker(_get_engine(), expire_on_commit=False)
+
+    return _sessionmaker()
+
+
+def _get_replica_engine() -> AsyncEngine:
+    global _replica_engine
+    if _replica_engine is None:
+        _replica_engine = create_async_engine(
+            _url(PSQL_REPLICA_HOST, PSQL_REPLICA_PORT),
+            echo=EVAULT_DEBUG,
+            connect_args={"ssl": PSQL_SSLMODE, "timeout": _REPLICA_CONNECT_TIMEOUT},
+            pool_size=PSQL_POOL_SIZE,
+            max_overflow=PSQL_POOL_MAX_OVERFLOW,
+            pool_timeout=PSQL_POOL_TIMEOUT,
+            pool_recycle=PSQL_POOL_RECYCLE,
+            pool_pre_ping=PSQL_POOL_PRE_PING,
+        )
+
+    return _replica_engine
+
+
+def _replica_session() -> AsyncSession:
+    global _replica_sessionmaker
+    if _replica_sessionmaker is None:
+        _replica_sessionmaker = async_sessionmaker(
+            _get_replica_engine(), expire_on_commit=False
+        )
+
+    return _replica_sessionmaker()
+
+
+class _ReplicaHealth:
+    """
+    Whether reads may go to the replica, re-checked at most once every
+    `_REPLICA_CHECK_INTERVAL` seconds by one caller, the others use the last
+    result meanwhile.
+    """
+
+    def __init__(self):
+        self.healthy = False
+        self.lag: float | None = None
+        self.checked_at = float("-inf")
+        self.reads = 0
+        self.fallbacks = 0
+        self._lock = asyncio.Lock()
+
+    async def usable(self) -> bool:
+        if time.monotonic() - self.checked_at >= _REPLICA_CHECK_INTERVAL:
+            if not self._lock.locked():
+                async with self._lock:
+                    await self._check()
 
-def get_repository(repo_id: int) -> Repository | None:
-    with Session(_engine) as s:
-        return s.get(Repository, repo_id)
+        return self.healthy
 
+    def mark_down(self):
+        self.healthy = False
+        self.checked_at = time.monotonic()
 
-def create_new_repository(
+    async def _check(self):
+        try:
+            lag = await asyncio.wait_for(_replica_lag(), _REPLICA_CHECK_TIMEOUT)
+            self.lag = float(lag)
+            healthy = self.lag <= PSQL_REPLICA_MAX_LAG
+            if not healthy and self.healthy:
+                logger.warning(f"Replica {self.lag:.1f}s behind, reading from primary")
+        except (DBAPIError, OSError, asyncio.TimeoutError) as e:
+            self.lag = None
+            healthy = False
+            if self.healthy:
+                logger.warning(f"Replica unavailable, reading from primary: {e}")
+
+        self.healthy = healthy
+        self.checked_at = time.monotonic()
+
+
+async def _replica_lag() -> float:
+    async with _get_replica_engine().connect() as conn:
+        return await conn.scalar(_REPLICA_LAG_QUERY)
+
+
+_replica_health = _ReplicaHealth()
+
+_user_writes = {"written": 0, "unchanged": 0, "cached": 0}
+
+
+@contextmanager
+def read_primary() -> Iterator[None]:
+    """
+    Sends the reads made inside the block to the primary, for callers that
+    can't tolerate replica lag.
+    """
+    token = _read_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_primary.reset(token)
+
+
+def _wrote():
+    _read_primary.set(True)
+
+
+async def _read[T](fn: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    """
+    Runs a read-only `fn` on the replica when there is a usable one, falling
+    back to the primary if it fails there.
+    """
+    if (
+        PSQL_REPLICA_HOST is not None
+        and not _read_primary.get()
+        and await _replica_health.usable()
+    ):
+        try:
+            async with _replica_session() as s:
+                result = await fn(s)
+            _replica_health.reads += 1
+            return result
+        except (DBAPIError, OSError) as e:
+            if isinstance(e, DBAPIError) and not e.connection_invalidated:
+                raise
+            logger.warning(f"Replica read failed, retrying on primary: {e}")
+            _replica_health.mark_down()
+
+    if PSQL_REPLICA_HOST is not None:
+        _replica_health.fallbacks += 1
+
+    async with _session() as s:
+        return await fn(s)
+
+
+async def ping():
+    async with _get_engine().connect() as conn:
+        await conn.execute(sql.text("SELECT 1"))
+
+
+async def close():
+    if _engine is not None:
+        await _engine.dispose()
+    if _replica_engine is not None:
+        await _replica_engine.dispose()
+
+
+def pool_stats() -> dict[str, int | float] | None:
+    """
+    returns the pool's configuration, live state and metrics, or None if the
+    engine hasn't been created yet.
+    """
+    if _engine is None:
+        return None
+
+    pool = _engine.sync_engine.pool
+    assert isinstance(pool, _TimedQueuePool)
+    return {
+        "size": pool.size(),
+        "max_overflow": PSQL_POOL_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+    } | _pool_metrics.stats()
+
+
+def replica_stats() -> dict[str, bool | int | float | None] | None:
+    if PSQL_REPLICA_HOST is None:
+        return None
+
+    return {
+        "healthy": _replica_health.healthy,
+        "lag": _replica_health.lag,
+        "reads": _replica_health.reads,
+        "fallbacks": _replica_health.fallbacks,
+    }
+
+
+async def get_repository(repo_id: int) -> Repository | None:
+    return await _read(lambda s: s.get(Repository, repo_id))
+
+
+async def get_repository_info(repo_id: int) -> RepositoryInfo | None:
+    """
+    returns the repository's metadata, read through the cache, filled from
+    the primary. Only existing repositories are cached.
+    """
+    info = await cache.get_repository_info(repo_id)
+    if info is not None:
+        return info
+
+    # what is cached is served for EVAULT_REPO_CACHE_REDIS_TTL, a lagging
+    # replica would bring back the row from before the last invalidation
+    with read_primary():
+        repo = await get_repository(repo_id)
+    if repo is None:
+        return None
+
+    info = RepositoryInfo(
+        id=repo.id,
+        name=repo.name,
+        owner_id=repo.owner_id,
+        bucket_addr=repo.bucket_addr,
+        key_epoch=repo.key_epoch,
+        rotating=repo.previous_key is not None,
+    )
+    await cache.cache_repository_info(info)
+    return info
+
+
+async def create_new_repository(
     repo_id: int,
     owner_id: int,
     repo_password: str,
@@ -48,40 +402,473 @@ def create_new_repository(
         bucket_addr=bucket_addr,
     )
 
-    with Session(_engine) as s:
+    async with _session() as s:
         try:
             s.add(repo)
-            s.commit()
-            s.refresh(repo)
+            await s.commit()
+            _wrote()
         except IntegrityError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Repository exists.",
             )
 
+    await cache.invalidate_repository(repo_id)
+
 
-def create_or_update_user(
+async def create_or_update_user(
     user_id: int,
     login: str,
     name: str,
     email: str | None,
-):
+) -> bool:
+    """
+    Inserts the user, or updates it if its profile changed. Most logins
+    change nothing: a profile matching the last one stored skips postgres
+    altogether, and otherwise the update only rewrites the row if a value is
+    distinct. returns whether the row was written.
+    """
+    # pylint: disable=E1102
+    fingerprint = blake3.blake3(json.dumps([login, name, email]).encode()).hexdigest()
+    if await cache.user_profile_matches(user_id, fingerprint):
+        _user_writes["cached"] += 1
+        return False
+
+    stmt = insert(User).values(id=user_id, login=login, name=name, email=email)
+    stmt = stmt.on_conflict_do_update(
+        constraint="users_pkey",
+        set_=dict(login=login, name=name, email=email),
+        where=sql.or_(
+            User.login.is_distinct_from(stmt.excluded.login),
+            User.name.is_distinct_from(stmt.excluded.name),
+            User.email.is_distinct_from(stmt.excluded.email),
+        ),
+    ).returning(User.id)
+
+    async with _session() as s:
+        result = await s.execute(stmt)
+        written = result.scalar_one_or_none() is not None
+        await s.commit()
+
+    if written:
+        _wrote()
+        _user_writes["written"] += 1
+    else:
+        _user_writes["unchanged"] += 1
+
+    await cache.cache_user_profile(user_id, fingerprint)
+    return written
+
+
+def user_write_stats() -> dict[str, int]:
+    """
+    How logins' user upserts ended: written, skipped by postgres since nothing
+    changed, or skipped before reaching postgres.
+    """
+    return dict(_user_writes)
+
+
+async def get_user(user_id: int) -> User | None:
+    return await _read(lambda s: s.get(User, user_id))
+
+
+async def push_envs(
+    repo_id: int,
+    stage: str,
+    variables: dict[str, str],
+    checksum: str,
+    payload_id: str,
+    key_epoch: int,
+    created_by: int,
+    description: str,
+) -> int:
+    """
+    Sets a repository's stage to exactly `variables` and records the new
+    `Version`, in a single statement no matter how many variables there are:
+
+        WITH deleted AS (DELETE FROM envs ... AND key <> ALL(:keys)),
+             upserted AS (INSERT INTO envs SELECT unnest(:keys), unnest(:values)
+                          ... ON CONFLICT (repository_id, stage, key) DO UPDATE)
+        INSERT INTO versions ... RETURNING version_number
+
+    The delete and the upsert touch disjoint keys. The repository row is
+    share-locked at `key_epoch`, the epoch the values were sealed at, so a
+    key rotation either waits for the push or makes it fail. returns the new
+    version number, raises 409 if another push to the repository committed
+    first or its key was rotated.
+    """
+    keys = sql.bindparam("keys", list(variables), ARRAY(sql.String))
+    values = sql.bindparam("values", list(variables.values()), ARRAY(sql.String))
+    now = sql.func.timezone("utc", sql.func.now())
+
+    deleted = (
+        sql.delete(Env)
+        .where(
+            Env.repository_id == repo_id,
+            Env.stage == stage,
+            Env.key != sql.func.all(keys),
+        )
+        .cte("deleted")
+    )
+
+    rows = sql.select(
+        sql.func.unnest(keys),
+        sql.func.unnest(values),
+        sql.literal(stage),
+        sql.literal(repo_id),
+        sql.literal(created_by),
+        now,
+    )
+    upsert = insert(Env).from_select(
+        ["key", "value", "stage", "repository_id", "created_by", "created_at"],
+        rows,
+    )
+    upserted = upsert.on_conflict_do_update(
+        index_elements=["repository_id", "stage", "key"],
+        set_=dict(
+            value=upsert.excluded.value,
+            created_by=upsert.excluded.created_by,
+            created_at=upsert.excluded.created_at,
+        ),
+    ).cte("upserted")
+
+    next_version = (
+        sql.select(Version.version_number + 1)
+        .where(Version.repository_id == repo_id)
+        .order_by(Version.version_number.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = (
+        insert(Version)
+        .values(
+            file_id=stage,
+            s3_id=payload_id,
+            version_number=sql.func.coalesce(next_version, 1),
+            change_description=description,
+            repository_id=repo_id,
+            created_by=created_by,
+            created_at=now,
+            checksum=checksum,
+        )
+        .add_cte(deleted)
+        .add_cte(upserted)
+        .returning(Version.version_number)
+    )
+
+    lock = (
+        sql.select(Repository.id)
+        .where(Repository.id == repo_id, Repository.key_epoch == key_epoch)
+        .with_for_update(read=True)
+    )
+
+    async with _session() as s:
+        if await s.scalar(lock) is None:
+            await s.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Repository key rotated during push, retry.",
+            )
+
+        try:
+            result = await s.execute(stmt)
+            version_number = result.scalar_one()
+            await s.commit()
+            _wrote()
+        except IntegrityError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Repository changed during push, retry.",
+            )
+
+        return version_number
+
+
+async def get_envs(repo_id: int, stage: str) -> dict[str, str]:
+    """
+    returns a stage's variables, sorted by key.
+    """
+    stmt = (
+        sql.select(Env.key, Env.value)
+        .where(Env.repository_id == repo_id, Env.stage == stage)
+        .order_by(Env.key)
+    )
+
+    async def read(s: AsyncSession) -> dict[str, str]:
+        result = await s.execute(stmt)
+        return {key: value for key, value in result.tuples()}
+
+    return await _read(read)
+
+
+async def get_latest_stage_version(repo_id: int, stage: str) -> Version | None:
+    stmt = (
+        sql.select(Version)
+        .where(Version.repository_id == repo_id, Version.file_id == stage)
+        .order_by(Version.version_number.desc())
+        .limit(1)
+    )
+    return await _read(lambda s: s.scalar(stmt))
+
+
+async def get_version(repo_id: int, version_number: int) -> Version | None:
+    stmt = sql.select(Version).where(
+        Version.repository_id == repo_id,
+        Version.version_number == version_number,
+    )
+    return await _read(lambda s: s.scalar(stmt))
+
+
+async def list_versions(
+    repo_id: int,
+    limit: int,
+    before: int | None = None,
+) -> list[Version]:
+    """
+    returns up to `limit` versions of the repository, newest first, older
+    than version `before` if given. Seeks the (repository_id, version_number
+    DESC) index, so every page costs the same however deep it is.
+    """
+    stmt = sql.select(Version).where(Version.repository_id == repo_id)
+    if before is not None:
+        stmt = stmt.where(Version.version_number < before)
+    stmt = stmt.order_by(Version.version_number.desc()).limit(limit)
+
+    async def read(s: AsyncSession) -> list[Version]:
+        return list(await s.scalars(stmt))
+
+    return await _read(read)
+
+
+async def list_env_keys(
+    repo_id: int,
+    stage: str,
+    limit: int,
+    after: str | None = None,
+) -> list[Env]:
+    """
+    returns up to `limit` variables of the stage, by key, after key `after`
+    if given. Values are not loaded.
+    """
+    stmt = (
+        sql.select(Env)
+        .options(defer(Env.value))
+        .where(Env.repository_id == repo_id, Env.stage == stage)
+    )
+    if after is not None:
+        stmt = stmt.where(Env.key > after)
+    stmt = stmt.order_by(Env.key).limit(limit)
+
+    async def read(s: AsyncSession) -> list[Env]:
+        return list(await s.scalars(stmt))
+
+    return await _read(read)
+
+
+async def list_user_repositories(
+    owner_id: int,
+    limit: int,
+    after: int | None = None,
+) -> list[RepositoryInfo]:
+    """
+    returns up to `limit` of the user's repositories, by id, after id `after`
+    if given.
+    """
+    stmt = sql.select(
+        Repository.id,
+        Repository.name,
+        Repository.owner_id,
+        Repository.bucket_addr,
+        Repository.key_epoch,
+        Repository.previous_key.is_not(None),
+    ).where(Repository.owner_id == owner_id)
+    if after is not None:
+        stmt = stmt.where(Repository.id > after)
+    stmt = stmt.order_by(Repository.id).limit(limit)
+
+    async def read(s: AsyncSession) -> list[RepositoryInfo]:
+        result = await s.execute(stmt)
+        return [RepositoryInfo(*row) for row in result.tuples()]
+
+    return await _read(read)
+
+
+async def begin_key_rotation(
+    repo_id: int,
+    epoch: int,
+    previous_key: str,
+    repo_password: str | None,
+) -> bool:
+    """
+    Moves the repository from key epoch `epoch - 1` to `epoch`, keeping the
+    wrapped previous key until every value is re-sealed, and setting the new
+    password digest if given. returns False if the repository isn't at
+    `epoch - 1`, or is still rotating.
+    """
+    values: dict = dict(key_epoch=epoch, previous_key=previous_key)
+    if repo_password is not None:
+        values["password"] = repo_password
+
     stmt = (
-        insert(User)
-        .values(id=user_id, login=login, name=name, email=email)
-        .on_conflict_do_update(
-            constraint="users_pkey",
-            set_=dict(login=login, name=name, email=email),
+        sql.update(Repository)
+        .where(
+            Repository.id == repo_id,
+            Repository.key_epoch == epoch - 1,
+            Repository.previous_key.is_(None),
         )
-        .returning(User)
+        .values(**values)
     )
 
-    with Session(_engine) as s:
-        result = s.execute(stmt)
-        s.commit()
-        return result.scalar_one()
+    async with _session() as s:
+        result = await s.execute(stmt)
+        await s.commit()
+        _wrote()
+
+    await cache.invalidate_repository(repo_id)
+    return result.rowcount == 1
+
+
+async def finish_key_rotation(repo_id: int, epoch: int) -> bool:
+    """
+    Drops the previous key once nothing is sealed with it anymore. returns
+    False if the repository moved on from `epoch` meanwhile.
+    """
+    stmt = (
+        sql.update(Repository)
+        .where(Repository.id == repo_id, Repository.key_epoch == epoch)
+        .values(previous_key=None)
+    )
+
+    async with _session() as s:
+        result = await s.execute(stmt)
+        await s.commit()
+        _wrote()
+
+    await cache.invalidate_repository(repo_id)
+    return result.rowcount == 1
+
+
+async def count_repository_rows(repo_id: int) -> tuple[int, int]:
+    """
+    returns how many variables and versions the repository has.
+    """
+    envs = sql.select(sql.func.count()).where(Env.repository_id == repo_id)
+    versions = sql.select(sql.func.count()).where(Version.repository_id == repo_id)
+
+    async def read(s: AsyncSession) -> tuple[int, int]:
+        return await s.scalar(envs), await s.scalar(versions)
+
+    return await _read(read)
+
 
+async def list_sealed_envs(repo_id: int, limit: int, after: int | None) -> list[Env]:
+    """
+    returns up to `limit` variables of the repository, every stage, by id,
+    after id `after` if given. Read from the primary, they're about to be
+    re-sealed.
+    """
+    stmt = sql.select(Env).where(Env.repository_id == repo_id)
+    if after is not None:
+        stmt = stmt.where(Env.id > after)
+    stmt = stmt.order_by(Env.id).limit(limit)
 
-def get_user(user_id: int) -> User | None:
-    with Session(_engine) as s:
-        return s.get(User, user_id)
+    async with _session() as s:
+        return list(await s.scalars(stmt))
+
+
+async def reseal_envs(updates: list[tuple[int, str, str]]) -> int:
+    """
+    Replaces the values of variables by id, `(id, old value, new value)`, in
+    one statement. A variable changed since `old value` was read is left
+    alone, its new value is sealed with the current key already. returns how
+    many were replaced.
+    """
+    if not updates:
+        return 0
+
+    ids, old, new = (list(column) for column in zip(*updates))
+    rows = sql.select(
+        sql.func.unnest(sql.bindparam("ids", ids, ARRAY(sql.Integer))).label("id"),
+        sql.func.unnest(sql.bindparam("old", old, ARRAY(sql.Text))).label("old"),
+        sql.func.unnest(sql.bindparam("new", new, ARRAY(sql.Text))).label("new"),
+    ).subquery("updates")
+    stmt = (
+        sql.update(Env)
+        .where(Env.id == rows.c.id, Env.value == rows.c.old)
+        .values(value=rows.c.new)
+    )
+
+    async with _session() as s:
+        result = await s.execute(stmt)
+        await s.commit()
+        _wrote()
+
+    return result.rowcount
+
+
+async def list_version_payloads(
+    repo_id: int,
+    limit: int,
+    after: int | None,
+) -> list[Version]:
+    """
+    returns up to `limit` versions of the repository, oldest first, newer
+    than version `after` if given. Read from the primary.
+    """
+    stmt = sql.select(Version).where(Version.repository_id == repo_id)
+    if after is not None:
+        stmt = stmt.where(Version.version_number > after)
+    stmt = stmt.order_by(Version.version_number).limit(limit)
+
+    async with _session() as s:
+        return list(await s.scalars(stmt))
+
+
+async def repoint_version_payloads(
+    updates: list[tuple[int, str, str]],
+) -> list[int]:
+    """
+    Points versions by id at new payloads, `(id, old payload, new payload)`,
+    in one statement. returns the ids of the versions updated.
+    """
+    if not updates:
+        return []
+
+    ids, old, new = (list(column) for column in zip(*updates))
+    rows = sql.select(
+        sql.func.unnest(sql.bindparam("ids", ids, ARRAY(sql.Integer))).label("id"),
+        sql.func.unnest(sql.bindparam("old", old, ARRAY(sql.String))).label("old"),
+        sql.func.unnest(sql.bindparam("new", new, ARRAY(sql.String))).label("new"),
+    ).subquery("updates")
+    stmt = (
+        sql.update(Version)
+        .where(Version.id == rows.c.id, Version.s3_id == rows.c.old)
+        .values(s3_id=rows.c.new)
+        .returning(Version.id)
+    )
+
+    async with _session() as s:
+        result = await s.execute(stmt)
+        updated = list(result.scalars())
+        await s.commit()
+        _wrote()
+
+    return updated
+
+
+async def referenced_payloads(repo_id: int, payload_ids: list[str]) -> set[str]:
+    """
+    returns which of `payload_ids` versions of the repository still point
+    at. Sealed payloads are shared within a repository only, identical ones
+    being stored once. Read from the primary.
+    """
+    if not payload_ids:
+        return set()
+
+    stmt = (
+        sql.select(Version.s3_id)
+        .where(Version.repository_id == repo_id, Version.s3_id.in_(payload_ids))
+        .distinct()
+    )
+    async with _session() as s:
+        return set(await s.scalars(stmt))
@@ -10,7 +10,8 @@ from fastapi.responses import (
     RedirectResponse,
     Response,
 )
-from fastapi import Cookie, Depends
+from fastapi import BackgroundTasks, Depends
+from starlette.concurrency import run_in_threadpool
 from starlette.status import (
     HTTP_200_OK,
     HTTP_204_NO_CONTENT,
@@ -23,12 +24,20 @@ from ..config import EVAULT_TOKEN_POLL_TTL
 from ..config import GITHUB_OAUTH_STATE_TTL
 from ..config import EVAULT_SESSION_TOKEN_TTL
 from ..config import EVAULT_TOKEN_POLL_MAX_ATTEMPT
+from ..config import EVAULT_TOKEN_POLL_WAIT
+from ..config import EVAULT_RATE_LIMIT_AUTH
 from .. import cache, database as db
 from ..github import oauth as gh_oauth, client as gh_client
 from ..types import DeviceType, UserSession
-from ..middlewares.auth import access_token_extractor
-
-router = APIRouter(prefix="/api/github/auth", dependencies=[])
+from ..middlewares.auth import access_token_extractor, user_session_extractor
+from ..middlewares.ratelimit import rate_limit
+
+router = APIRouter(
+    prefix="/api/github/auth",
+    dependencies=[
+        Depends(rate_limit("auth", *EVAULT_RATE_LIMIT_AUTH, by="ip")),
+    ],
+)
 
 
 @router.get("/")
@@ -41,7 +50,7 @@ async def auth(device_type: DeviceType):
         device_type,
     )
 
-    cache.cache_auth_url(session_id, oauth_login_url, GITHUB_OAUTH_STATE_TTL)
+    await cache.cache_auth_url(session_id, oauth_login_url, GITHUB_OAUTH_STATE_TTL)
     if device_type == "web":
         return RedirectResponse(
             url=oauth_login_url,
@@ -57,23 +66,22 @@ async def auth(device_type: DeviceType):
 
 
 @router.get("/url")
-def auth_url(session_id: str):
-    oauth_login_url = cache.get_auth_url(session_id)
-    oauth_login_url = oauth_login_url.decode()
-    cache.renew_auth_url(session_id, GITHUB_OAUTH_STATE_TTL)
+async def auth_url(session_id: str):
+    oauth_login_url = await cache.get_auth_url(session_id)
+    await cache.renew_auth_url(session_id, GITHUB_OAUTH_STATE_TTL)
 
     return PlainTextResponse(content=oauth_login_url)
 
 
 @router.get("/token")
-def auth_token(
+async def auth_token(
     session_id: str,
     code: str,
     state: str,
     device_type: DeviceType,
+    background_tasks: BackgroundTasks,
 ):
-    oauth_login_url = cache.get_auth_url(session_id)
-    cache.remove_auth_url(session_id)
+    oauth_login_url = await cache.pop_auth_url(session_id)
     params = urlparse.parse_qs(urlparse.urlparse(oauth_login_url).query)
 
     # verify state
@@ -87,10 +95,12 @@ def auth_token(
         )
 
     # get access token from github
-    gh_token = gh_client.fetch_user_auth_token(code)
+    gh_token = await run_in_threadpool(gh_client.fetch_user_auth_token, code)
 
     # get user information
-    gh_user, user_email = gh_client.fetch_github_credentials(gh_token)
+    gh_user, user_email = await run_in_threadpool(
+        gh_client.fetch_github_credentials, gh_token
+    )
 
     # store a (new) session: github user to cache
     # create an evault access token, then cache it
@@ -98,25 +108,31 @@ def auth_token(
     if device_type == "web":
         user_session.csrf_token = secrets.token_hex(32)
 
-    evault_access_token = secrets.token_urlsafe(32)
-    cache.create_user_session(
-        evault_access_token, user_session, EVAULT_SESSION_TOKEN_TTL
-    )
-
-    db.create_or_update_user(
+    await db.create_or_update_user(
         user_id=gh_user.id,
         login=gh_user.login,
         name=gh_user.name,
         email=user_email,
     )
 
+    evault_access_token = secrets.token_urlsafe(32)
+    async with cache.batch() as pipe:
+        await cache.create_user_session(
+            evault_access_token, user_session, EVAULT_SESSION_TOKEN_TTL, pipe
+        )
+        if device_type == "cli":
+            await cache.cache_token_poll(
+                session_id,
+                evault_access_token,
+                EVAULT_TOKEN_POLL_TTL,
+                pipe,
+            )
+
+    # keep the user's session index tidy, off the login's critical path
+    background_tasks.add_task(cache.prune_user_sessions, gh_user.id)
+
     response: fastapi.Response
     if device_type == "cli":
-        cache.cache_token_poll(
-            session_id,
-            evault_access_token,
-            EVAULT_TOKEN_POLL_TTL,
-        )
         response = fastapi.Response(status_code=HTTP_200_OK)
     else:  # for web, set the cookie + transmit a session csrf token
         response = PlainTextResponse(
@@ -134,7 +150,7 @@ def auth_token(
 
 @router.get("/poll")
 async def auth_poll(session_id: str, req: fastapi.Request):
-    access_token: str | None = cache.get_token_poll(session_id)
+    access_token: str | None = await cache.get_token_poll(session_id)
 
     if access_token is not None:
         return JSONResponse(
@@ -159,8 +175,26 @@ async def auth_poll(session_id: str, req: fastapi.Request):
     return response
 
 
+@router.get("/poll/wait")
+async def auth_poll_wait(session_id: str):
+    """
+    Long polling alternative to /poll: answers as soon as the token is issued,
+    or with a pending status after `EVAULT_TOKEN_POLL_WAIT` seconds, in which
+    case the client should call again.
+    """
+    access_token = await cache.wait_token_poll(session_id, EVAULT_TOKEN_POLL_WAIT)
+
+    if access_token is not None:
+        return JSONResponse(
+            status_code=HTTP_200_OK,
+            content={"status": "ok", "access_token": access_token},
+        )
+
+    return JSONResponse(status_code=HTTP_200_OK, content={"status": "pending"})
+
+
 @router.get("/refresh")
-def auth_refresh(
+async def auth_refresh(
     access_token: str,
     device_type: DeviceType,
     request: Request,
@@ -168,7 +202,7 @@ def auth_refresh(
     """
     for device_type=web, the access_token should be an empty string
     """
-    cache.renew_user_session(access_token, EVAULT_SESSION_TOKEN_TTL)
+    await cache.renew_user_session(access_token, EVAULT_SESSION_TOKEN_TTL)
 
     if device_type == "cli":
         return fastapi.Response(status_code=HTTP_200_OK)
@@ -185,9 +219,12 @@ def auth_refresh(
     return response
 
 
-@router.post("/logout", dependencies=[Depends(access_token_extractor)])
-async def logout(evault_access_token: str | None = Cookie(None)):
-    cache.remove_session(evault_access_token)
+@router.post("/logout")
+async def logout(
+    evault_access_token: str = Depends(access_token_extractor),
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    await cache.remove_session(evault_access_token, user_session.user.id)
     response = Response(status_code=HTTP_204_NO_CONTENT)
     response.set_cookie(key="evault_access_token", value="", max_age=0)
     return response
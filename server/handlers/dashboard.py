@@ -1,30 +1,46 @@
 from dataclasses import asdict
-from fastapi import Depends, HTTPException, status
+from typing import Any, Callable
+from blake3 import blake3
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.responses import JSONResponse, Response
-from fastapi.encoders import jsonable_encoder
+from loguru import logger
 from fastapi.routing import APIRouter
+from starlette.concurrency import run_in_threadpool
 from ..github import client as httpclient
-from .. import cache
 from .. import database as db
-from ..validators import valid_user_repo_string
-from ..middlewares.auth import access_token_extractor
-from ..crypto import passwordhash
-
+from ..validators import valid_env_key, valid_stage, valid_user_repo_string
+from ..middlewares.auth import user_session_extractor
+from ..middlewares.ratelimit import rate_limit
+from ..config import EVAULT_RATE_LIMIT_DASHBOARD, EVAULT_RATE_LIMIT_NEW_REPOSITORY
+from ..config import EVAULT_RATE_LIMIT_KEY_ROTATION, EVAULT_UNLOCK_TOKEN_TTL
+from ..config import EVAULT_PUSH_MAX_KEYS, EVAULT_ENV_VALUE_MAX_LENGTH
+from ..config import EVAULT_SNAPSHOT_INTERVAL
+from ..config import EVAULT_PAGE_SIZE_DEFAULT, EVAULT_PAGE_SIZE_MAX
+from ..types import EnvPush, KeyRotation, RepositoryInfo, UserSession
+from ..utils import checksum_envs
+from ..storage import BlobNotFound, iter_chunks
+from ..storage.backend import get_blob_store
+from ..versioning import VersionPayload, make_payload, materialize
+from ..pagination import Page, clamp_limit, decode_cursor, make_page
+from ..crypto import envelope, hashing, keystore
+from ..crypto.keystore import RepositoryKeys
+from .. import rotation
 
 router = APIRouter(
     prefix="/api/github/dashboard",
     dependencies=[
-        Depends(access_token_extractor),
+        Depends(user_session_extractor),
+        Depends(rate_limit("dashboard", *EVAULT_RATE_LIMIT_DASHBOARD, by="user")),
     ],
 )
 
 
 @router.get("/repositories")
-def get_user_repositories(
-    evault_access_token: str = Depends(access_token_extractor),
+async def get_user_repositories(
+    user: UserSession = Depends(user_session_extractor),
 ):
-    user = cache.get_user_session(evault_access_token)
-    repos = httpclient.fetch_user_repositories(
+    repos = await run_in_threadpool(
+        httpclient.fetch_user_repositories,
         user.gh_token.token_type,
         user.gh_token.access_token,
     )
@@ -41,11 +57,30 @@ def get_user_repositories(
     )
 
 
+@router.get("/repositories/registered")
+async def list_registered_repositories(
+    limit: int | None = None,
+    cursor: str | None = None,
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    The user's repositories registered with evault, by id.
+    """
+    limit = clamp_limit(limit, EVAULT_PAGE_SIZE_DEFAULT, EVAULT_PAGE_SIZE_MAX)
+    after = _decode_cursor("repositories", cursor, int)
+    rows = await db.list_user_repositories(
+        user_session.user.id, limit + 1, after[0] if after else None
+    )
+
+    page = make_page("repositories", rows, limit, lambda r: [r.id])
+    return _page_response(page, asdict)
+
+
 @router.get("/repository/{repo_id}")
-def get_repository(
+async def get_repository(
     repo_id: int,
     repo: str,
-    evault_access_token: str = Depends(access_token_extractor),
+    user_session: UserSession = Depends(user_session_extractor),
 ):
     if not valid_user_repo_string(repo):
         raise HTTPException(
@@ -53,15 +88,14 @@ def get_repository(
             detail="Invalid repository format.",
         )
 
-    db_repo = db.get_repository(repo_id)
+    db_repo = await db.get_repository_info(repo_id)
 
     # if repo is provided, we need to check for ownership
     if db_repo is None:
         [owner, repo_name] = repo.split("/")
 
-        user_session = cache.get_user_session(evault_access_token)
-
-        remote_repository = httpclient.fetch_repository(
+        remote_repository = await run_in_threadpool(
+            httpclient.fetch_repository,
             user_session.gh_token.token_type,
             user_session.gh_token.access_token,
             owner,
@@ -83,16 +117,23 @@ def get_repository(
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
-        content=jsonable_encoder(db_repo),
+        content=asdict(db_repo),
     )
 
 
-@router.post("/repository/new")
-def create_new_repository(
+@router.post(
+    "/repository/new",
+    dependencies=[
+        Depends(
+            rate_limit("new-repository", *EVAULT_RATE_LIMIT_NEW_REPOSITORY, by="user")
+        ),
+    ],
+)
+async def create_new_repository(
     repo_id: int,
     password: str,
     repo_fullname: str,
-    evault_access_token: str = Depends(access_token_extractor),
+    d: UserSession = Depends(user_session_extractor),
 ):
     # TODO: sanitize password
     if not valid_user_repo_string(repo_fullname):
@@ -103,9 +144,8 @@ def create_new_repository(
 
     [owner, repo_name] = repo_fullname.split("/")
 
-    d = cache.get_user_session(evault_access_token)
-
-    repository = httpclient.fetch_repository(
+    repository = await run_in_threadpool(
+        httpclient.fetch_repository,
         d.gh_token.token_type,
         d.gh_token.access_token,
         owner,
@@ -124,8 +164,8 @@ def create_new_repository(
             detail="Invalid repository.",
         )
 
-    digest = passwordhash.hash(password)
-    db.create_new_repository(
+    digest = await hashing.hash(password)
+    await db.create_new_repository(
         repo_id=repo_id,
         owner_id=repository.owner.id,
         repo_password=digest,
@@ -133,3 +173,521 @@ def create_new_repository(
         bucket_addr=None,
     )
     return Response(status_code=status.HTTP_201_CREATED)
+
+
+@router.post("/repository/{repo_id}/envs/{stage}")
+async def push_envs(
+    repo_id: int,
+    stage: str,
+    push: EnvPush,
+    x_evault_password: str = Header(),
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    Replaces every variable of `stage` with the pushed ones, as a new version.
+    Values are sealed with the repository key, unlocked by its password.
+    """
+    if not valid_stage(stage):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid stage.",
+        )
+
+    if len(push.variables) > EVAULT_PUSH_MAX_KEYS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {EVAULT_PUSH_MAX_KEYS} variables per push.",
+        )
+
+    for key, value in push.variables.items():
+        if not valid_env_key(key) or len(value) > EVAULT_ENV_VALUE_MAX_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid variable '{key[:255]}'.",
+            )
+
+    if len(push.description) > 1000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Description too long.",
+        )
+
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    checksum = checksum_envs(push.variables)
+    with await keystore.unlock(db_repo, x_evault_password) as keys:
+        payload = await _make_stage_payload(keys, repo_id, stage, push.variables)
+        sealed = await run_in_threadpool(
+            envelope.seal_envs,
+            keys.current,
+            keys.epoch,
+            repo_id,
+            stage,
+            push.variables,
+        )
+
+        data = payload.encode()
+        # pylint: disable=E1102
+        digest = blake3(data).digest()
+        # stored first, so a version never refers to a missing payload
+        blob = await get_blob_store().put(
+            envelope.seal_stream(
+                keys.current, keys.epoch, repo_id, stage, iter_chunks(data), digest
+            )
+        )
+
+    version_number = await db.push_envs(
+        repo_id=repo_id,
+        stage=stage,
+        variables=sealed,
+        checksum=checksum,
+        payload_id=blob.checksum,
+        key_epoch=keys.epoch,
+        created_by=user_session.user.id,
+        description=push.description,
+    )
+
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content={
+            "version": version_number,
+            "checksum": checksum,
+            "count": len(push.variables),
+        },
+    )
+
+
+@router.get("/repository/{repo_id}/envs/{stage}")
+async def pull_envs(
+    repo_id: int,
+    stage: str,
+    x_evault_password: str | None = Header(None),
+    x_evault_unlock_token: str | None = Header(None),
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    The stage's variables, unlocked by the repository password or an unlock
+    token for the stage.
+    """
+    if not valid_stage(stage):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid stage.",
+        )
+
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    keys = await _unlock_for_read(
+        db_repo,
+        user_session.user.id,
+        stage,
+        x_evault_password,
+        x_evault_unlock_token,
+    )
+    sealed = await db.get_envs(repo_id, stage)
+    with keys:
+        variables = await _open_envs(keys, repo_id, stage, sealed)
+
+    latest = await db.get_latest_stage_version(repo_id, stage)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "version": latest.version_number if latest is not None else None,
+            "checksum": checksum_envs(variables),
+            "variables": variables,
+        },
+    )
+
+
+@router.get("/repository/{repo_id}/versions")
+async def list_versions(
+    repo_id: int,
+    limit: int | None = None,
+    cursor: str | None = None,
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    The repository's versions, newest first.
+    """
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    limit = clamp_limit(limit, EVAULT_PAGE_SIZE_DEFAULT, EVAULT_PAGE_SIZE_MAX)
+    before = _decode_cursor("versions", cursor, int)
+    rows = await db.list_versions(repo_id, limit + 1, before[0] if before else None)
+
+    page = make_page("versions", rows, limit, lambda v: [v.version_number])
+    return _page_response(
+        page,
+        lambda v: {
+            "version": v.version_number,
+            "stage": v.file_id,
+            "checksum": v.checksum,
+            "description": v.change_description,
+            "created_by": v.created_by,
+            "created_at": v.created_at.isoformat(),
+        },
+    )
+
+
+@router.get("/repository/{repo_id}/envs/{stage}/keys")
+async def list_env_keys(
+    repo_id: int,
+    stage: str,
+    limit: int | None = None,
+    cursor: str | None = None,
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    The stage's variable names, sorted, without their values.
+    """
+    if not valid_stage(stage):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid stage.",
+        )
+
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    limit = clamp_limit(limit, EVAULT_PAGE_SIZE_DEFAULT, EVAULT_PAGE_SIZE_MAX)
+    after = _decode_cursor(f"keys:{stage}", cursor, str)
+    rows = await db.list_env_keys(
+        repo_id, stage, limit + 1, after[0] if after else None
+    )
+
+    page = make_page(f"keys:{stage}", rows, limit, lambda e: [e.key])
+    return _page_response(
+        page,
+        lambda e: {
+            "key": e.key,
+            "created_by": e.created_by,
+            "created_at": e.created_at.isoformat(),
+        },
+    )
+
+
+@router.get("/repository/{repo_id}/versions/{version_number}")
+async def get_version_envs(
+    repo_id: int,
+    version_number: int,
+    x_evault_password: str | None = Header(None),
+    x_evault_unlock_token: str | None = Header(None),
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    returns the variables of the version's stage as of that version.
+    """
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    version = await db.get_version(repo_id, version_number)
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Version not found.",
+        )
+
+    async def load(n: int) -> VersionPayload:
+        v = version if n == version_number else await db.get_version(repo_id, n)
+        if v is None:
+            raise ValueError(f"missing version {n}")
+        return await _load_payload(keys, repo_id, v.file_id, v.s3_id)
+
+    keys = await _unlock_for_read(
+        db_repo,
+        user_session.user.id,
+        version.file_id,
+        x_evault_password,
+        x_evault_unlock_token,
+    )
+    with keys:
+        try:
+            variables = await materialize(version_number, load)
+        except (ValueError, BlobNotFound) as e:
+            logger.error(f"Failed to materialize {repo_id}@{version_number}: {e}")
+            variables = None
+
+    if variables is None or checksum_envs(variables) != version.checksum:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Version history is corrupted.",
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "version": version.version_number,
+            "stage": version.file_id,
+            "checksum": version.checksum,
+            "variables": variables,
+        },
+        headers={"ETag": f'"{version.checksum}"'},
+    )
+
+
+@router.post("/repository/{repo_id}/envs/{stage}/unlock")
+async def unlock_stage(
+    repo_id: int,
+    stage: str,
+    ttl: int | None = None,
+    x_evault_password: str = Header(),
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    Checks the repository password once and returns a token pulling the
+    stage without it, for `ttl` seconds, at most `EVAULT_UNLOCK_TOKEN_TTL`.
+    Pass it as `X-Evault-Unlock-Token`.
+    """
+    if not valid_stage(stage):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid stage.",
+        )
+
+    if ttl is not None and not 0 < ttl <= EVAULT_UNLOCK_TOKEN_TTL:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"ttl must be within 1 and {EVAULT_UNLOCK_TOKEN_TTL} seconds.",
+        )
+
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    token, claims = await keystore.issue_unlock_token(
+        db_repo,
+        user_session.user.id,
+        stage,
+        x_evault_password,
+        ttl or EVAULT_UNLOCK_TOKEN_TTL,
+    )
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content={
+            "token": token,
+            "stage": claims.stage,
+            "expires_at": claims.expires_at,
+        },
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+@router.delete("/repository/{repo_id}/unlock")
+async def revoke_unlock_tokens(
+    repo_id: int,
+    x_evault_unlock_token: str | None = Header(None),
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    Revokes the unlock token sent along, or every unlock token of the
+    repository if none is.
+    """
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    if x_evault_unlock_token is not None:
+        await keystore.revoke_unlock_token(
+            db_repo, user_session.user.id, x_evault_unlock_token
+        )
+    else:
+        await keystore.revoke_unlock_tokens(db_repo)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post(
+    "/repository/{repo_id}/keys/rotation",
+    dependencies=[
+        Depends(rate_limit("key-rotation", *EVAULT_RATE_LIMIT_KEY_ROTATION, by="user")),
+    ],
+)
+async def rotate_repository_key(
+    repo_id: int,
+    body: KeyRotation,
+    x_evault_password: str = Header(),
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    """
+    Rotates the repository key, re-sealing its variables and versions in the
+    background, or resumes the rotation in progress. Pulls and pushes keep
+    working meanwhile, with the new password if one was given.
+    """
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    epoch = await rotation.start(db_repo, x_evault_password, body.new_password)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"key_epoch": epoch},
+    )
+
+
+@router.get("/repository/{repo_id}/keys/rotation")
+async def get_key_rotation(
+    repo_id: int,
+    user_session: UserSession = Depends(user_session_extractor),
+):
+    db_repo = await db.get_repository_info(repo_id)
+    if db_repo is None or db_repo.owner_id != user_session.user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Repository not found.",
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=await rotation.describe(db_repo),
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+def _decode_cursor(kind: str, cursor: str | None, *types: type) -> list | None:
+    if cursor is None:
+        return None
+
+    try:
+        return decode_cursor(kind, cursor, types)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor.",
+        )
+
+
+def _page_response[T](page: Page[T], serialize: Callable[[T], Any]) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "items": [serialize(item) for item in page.items],
+            "next_cursor": page.next_cursor,
+        },
+    )
+
+
+async def _unlock_for_read(
+    repo: RepositoryInfo,
+    user_id: int,
+    stage: str,
+    password: str | None,
+    unlock_token: str | None,
+) -> RepositoryKeys:
+    # an unlock token is a cheap check, the password means an argon2 verify
+    # unless the keyring has the key already
+    if unlock_token is not None:
+        return await keystore.unlock_with_token(repo, user_id, stage, unlock_token)
+
+    if password is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Repository password or unlock token required.",
+        )
+
+    return await keystore.unlock(repo, password)
+
+
+async def _open_envs(
+    keys: RepositoryKeys,
+    repo_id: int,
+    stage: str,
+    sealed: dict[str, str],
+) -> dict[str, str]:
+    try:
+        return await run_in_threadpool(
+            envelope.open_envs, keys.keys, repo_id, stage, sealed
+        )
+    except envelope.EnvelopeError as e:
+        logger.error(f"Failed to open {repo_id}/{stage}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Stored variables are corrupted.",
+        )
+
+
+async def _load_payload(
+    keys: RepositoryKeys,
+    repo_id: int,
+    stage: str,
+    payload_id: str,
+) -> VersionPayload:
+    """
+    raises ValueError, EnvelopeError being one, if the payload is unreadable.
+    """
+    chunks = envelope.open_stream(
+        keys.keys, repo_id, stage, get_blob_store().open(payload_id)
+    )
+    return VersionPayload.decode(b"".join([chunk async for chunk in chunks]))
+
+
+async def _make_stage_payload(
+    keys: RepositoryKeys,
+    repo_id: int,
+    stage: str,
+    variables: dict[str, str],
+) -> VersionPayload:
+    """
+    The payload of the stage's next version: a delta against its current
+    state, or a snapshot every `EVAULT_SNAPSHOT_INTERVAL` versions, or when
+    the current state can't be trusted to match the latest version.
+    """
+    with db.read_primary():
+        previous = await db.get_latest_stage_version(repo_id, stage)
+        current = await db.get_envs(repo_id, stage)
+
+    try:
+        current = await run_in_threadpool(
+            envelope.open_envs, keys.keys, repo_id, stage, current
+        )
+    except envelope.EnvelopeError as e:
+        logger.warning(f"Unreadable variables in {repo_id}/{stage}, snapshotting: {e}")
+        return make_payload(variables, None, None, 0, EVAULT_SNAPSHOT_INTERVAL)
+
+    if previous is None or checksum_envs(current) != previous.checksum:
+        return make_payload(variables, None, None, 0, EVAULT_SNAPSHOT_INTERVAL)
+
+    try:
+        previous_payload = await _load_payload(keys, repo_id, stage, previous.s3_id)
+    except (ValueError, BlobNotFound) as e:
+        logger.warning(f"Unreadable payload {previous.s3_id}, snapshotting: {e}")
+        return make_payload(variables, None, None, 0, EVAULT_SNAPSHOT_INTERVAL)
+
+    return make_payload(
+        variables,
+        current,
+        previous.version_number,
+        previous_payload.depth,
+        EVAULT_SNAPSHOT_INTERVAL,
+    )
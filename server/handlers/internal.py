@@ -0,0 +1,44 @@
+import secrets
+from fastapi import Depends, Header, HTTPException, status
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRouter
+from ..config import EVAULT_INTERNAL_TOKEN
+from .. import cache, database as db
+from ..crypto import hashing, keystore
+
+
+def internal_token_guard(
+    x_evault_internal_token: str | None = Header(None),
+):
+    """
+    The internal routes only exist for operators, they 404 unless
+    `EVAULT_INTERNAL_TOKEN` is configured and sent back in the header.
+    """
+    if EVAULT_INTERNAL_TOKEN is None or x_evault_internal_token is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    if not secrets.compare_digest(x_evault_internal_token, EVAULT_INTERNAL_TOKEN):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+router = APIRouter(
+    prefix="/api/internal",
+    dependencies=[Depends(internal_token_guard)],
+    include_in_schema=False,
+)
+
+
+@router.get("/stats")
+async def stats():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "session_cache": cache.session_cache_stats(),
+            "repository_cache": cache.repository_cache_stats(),
+            "database_pool": db.pool_stats(),
+            "database_replica": db.replica_stats(),
+            "user_writes": db.user_write_stats(),
+            "keyring": keystore.keyring_stats(),
+            "password_hashing": hashing.hashing_stats(),
+        },
+    )
@@ -1,11 +1,23 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response
 from loguru import logger
-from . import dashboard, auth, user
+from . import dashboard, auth, user, internal
+from .. import cache, lifecycle
 
 
-mux = FastAPI()
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await lifecycle.connect_backends()
+    events = asyncio.create_task(cache.listen_events())
+    yield
+    events.cancel()
+    await lifecycle.close_backends()
+
+
+mux = FastAPI(lifespan=lifespan)
 mux.add_middleware(
     # TODO: configure this for prod
     CORSMiddleware,
@@ -16,7 +28,7 @@ mux.add_middleware(
 )
 
 
-routers = [dashboard.router, auth.router, user.router]
+routers = [dashboard.router, auth.router, user.router, internal.router]
 
 for router in routers:
     mux.include_router(router)
@@ -26,3 +38,21 @@ for router in routers:
 @mux.get("/api/healthcheck")
 def healthcheck():
     return Response(status_code=status.HTTP_200_OK)
+
+
+@mux.get("/api/readiness")
+async def readiness():
+    """
+    Unlike the healthcheck, fails (503) while redis or postgres is unreachable.
+    """
+    backends = await lifecycle.readiness()
+    ready = all(backends.values())
+    code = status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(
+        status_code=code,
+        content={
+            "ready": ready,
+            "backends": backends,
+            "startup_seconds": lifecycle.startup_seconds,
+        },
+    )
@@ -1,19 +1,45 @@
 from dataclasses import asdict
 from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
-from ..middlewares.auth import access_token_extractor
+from ..middlewares.auth import access_token_extractor, user_session_extractor
+from ..types import UserSession
 from .. import cache
 from starlette.status import HTTP_200_OK
 
 router = APIRouter(
     prefix="/api/github/user",
-    dependencies=[Depends(access_token_extractor)],
+    dependencies=[Depends(user_session_extractor)],
 )
 
 
 @router.get("")
-def get_user_information(
-    evault_access_token: str | None = Depends(access_token_extractor),
+async def get_user_information(
+    d: UserSession = Depends(user_session_extractor),
 ):
-    d = cache.get_user_session(evault_access_token)
     return JSONResponse(status_code=HTTP_200_OK, content=asdict(d.user))
+
+
+@router.get("/sessions")
+async def get_user_sessions(
+    evault_access_token: str = Depends(access_token_extractor),
+    d: UserSession = Depends(user_session_extractor),
+):
+    current = cache.make_session_id(evault_access_token)
+    sessions = await cache.list_user_sessions(d.user.id)
+
+    body = [asdict(s) | {"current": s.id == current} for s in sessions]
+    return JSONResponse(status_code=HTTP_200_OK, content=body)
+
+
+@router.delete("/sessions")
+async def revoke_user_sessions(
+    d: UserSession = Depends(user_session_extractor),
+):
+    """
+    Signs the user out everywhere, including the current session.
+    """
+    revoked = await cache.revoke_user_sessions(d.user.id)
+
+    response = JSONResponse(status_code=HTTP_200_OK, content={"revoked": revoked})
+    response.set_cookie(key="evault_access_token", value="", max_age=0)
+    return response
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+from loguru import logger
+from . import cache, database as db, rotation
+from .crypto import hashing
+from .config import EVAULT_STARTUP_ATTEMPTS, EVAULT_STARTUP_BUDGET
+from .utils import retry_with_backoff
+
+_STARTED_AT = time.perf_counter()
+_READINESS_TIMEOUT = 1.0  # seconds
+
+# seconds from this module's import to the app accepting requests
+startup_seconds: float | None = None
+
+
+_BACKENDS: dict[str, Callable[[], Awaitable[None]]] = {
+    "redis": cache.ping,
+    "database": db.ping,
+}
+
+
+async def connect_backends():
+    """
+    Waits for every backend concurrently, retrying with backoff, for at most
+    `EVAULT_STARTUP_BUDGET` seconds. The app starts regardless: backends still
+    down are connected lazily on first use, `readiness` reports them until then.
+    """
+
+    async def connect(name: str, ping: Callable[[], Awaitable[None]]):
+        async def attempt():
+            try:
+                await ping()
+            except Exception as e:
+                logger.warning(f"{name} unavailable: {e}")
+                raise
+
+        await retry_with_backoff(attempt, attempts=EVAULT_STARTUP_ATTEMPTS)
+        logger.info(f"Connected to {name}")
+
+    tasks = {
+        name: asyncio.create_task(connect(name, ping))
+        for name, ping in _BACKENDS.items()
+    }
+    _, pending = await asyncio.wait(tasks.values(), timeout=EVAULT_STARTUP_BUDGET)
+    for task in pending:
+        task.cancel()
+
+    failed = [
+        name
+        for name, task in tasks.items()
+        if task in pending or task.exception() is not None
+    ]
+
+    global startup_seconds
+    startup_seconds = time.perf_counter() - _STARTED_AT
+    if failed:
+        logger.error(f"Starting without: {', '.join(failed)}")
+    if startup_seconds > EVAULT_STARTUP_BUDGET:
+        logger.warning(
+            f"Startup took {startup_seconds:.3f}s, "
+            f"over the {EVAULT_STARTUP_BUDGET}s budget"
+        )
+    logger.info(f"Started in {startup_seconds:.3f}s")
+
+
+async def close_backends():
+    await rotation.shutdown()
+    await cache.close()
+    await db.close()
+    hashing.shutdown()
+
+
+async def readiness() -> dict[str, bool]:
+    async def check(ping: Callable[[], Awaitable[None]]) -> bool:
+        try:
+            await asyncio.wait_for(ping(), timeout=_READINESS_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    results = await asyncio.gather(*(check(ping) for ping in _BACKENDS.values()))
+    return dict(zip(_BACKENDS, results))
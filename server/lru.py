@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from typing import Callable
+
+
+class TTLCache[K, V]:
+    """
+    A bounded, in-process LRU cache where every entry also expires `ttl`
+    seconds after it was inserted. Not thread safe, meant to be used from the
+    event loop.
+
+    `on_evict` is called with the key and value of every entry leaving the
+    cache, whether it expired, was pushed out by the size bound or removed.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        on_evict: Callable[[K, V], None] | None = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        assert maxsize > 0
+        assert ttl > 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._on_evict = on_evict
+        self._timer = timer
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self._timer()
+
+    def get(self, key: K) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self._timer():
+            self._evict(key)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: K, value: V):
+        if key in self._data:
+            self._evict(key)
+
+        self._data[key] = (self._timer() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._evict(next(iter(self._data)))
+
+    def pop(self, key: K) -> V | None:
+        if key not in self._data:
+            return None
+
+        _, value = self._data[key]
+        self._evict(key)
+        return value
+
+    def clear(self):
+        for key in list(self._data):
+            self._evict(key)
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _evict(self, key: K):
+        _, value = self._data.pop(key)
+        self.evictions += 1
+        if self._on_evict is not None:
+            self._on_evict(key, value)
@@ -1,9 +1,10 @@
-from fastapi import Cookie, HTTPException, status
+from fastapi import Cookie, Depends, HTTPException, Request, status
 from ..config import EVAULT_SESSION_TOKEN_TTL
+from ..types import UserSession
 from .. import cache
 
 
-def access_token_extractor(
+async def access_token_extractor(
     evault_access_token: str | None = Cookie(None),
 ) -> str:
     if evault_access_token is None:
@@ -12,10 +13,25 @@ def access_token_extractor(
             detail="Access token not found/expired.",
         )
 
-    # extend the session
-    cache.renew_user_session(
+    return evault_access_token
+
+
+async def user_session_extractor(
+    request: Request,
+    evault_access_token: str = Depends(access_token_extractor),
+) -> UserSession:
+    """
+    Validates and extends the session, returning the cached `UserSession`.
+    The session is memoized on the request, so the Redis round trip happens
+    at most once no matter how many dependencies ask for it.
+    """
+    user_session: UserSession | None = getattr(request.state, "user_session", None)
+    if user_session is not None:
+        return user_session
+
+    user_session = await cache.fetch_user_session(
         evault_access_token,
         EVAULT_SESSION_TOKEN_TTL,
     )
-
-    return evault_access_token
+    request.state.user_session = user_session
+    return user_session
@@ -0,0 +1,45 @@
+import math
+from typing import Literal
+from fastapi import Depends, HTTPException, Request, status
+from ..types import UserSession
+from .auth import access_token_extractor, user_session_extractor
+from .. import cache
+
+type RateLimitKey = Literal["ip", "session", "user"]
+
+
+def rate_limit(
+    scope: str,
+    limit: int,
+    window: float,
+    by: RateLimitKey = "ip",
+):
+    """
+    returns a dependency allowing `limit` requests per sliding `window`
+    seconds, counted per client ip, session or user under `scope`. Requests
+    over the limit get a 429 with a `Retry-After` header.
+
+        router = APIRouter(dependencies=[Depends(rate_limit("auth", 30, 60))])
+    """
+
+    async def check(identity: str):
+        retry_after = await cache.hit_rate_limit(
+            f"{scope}:{by}:{identity}", limit, window
+        )
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    async def by_ip(request: Request):
+        await check(request.client.host if request.client else "unknown")
+
+    async def by_session(evault_access_token: str = Depends(access_token_extractor)):
+        await check(cache.make_session_id(evault_access_token))
+
+    async def by_user(user_session: UserSession = Depends(user_session_extractor)):
+        await check(str(user_session.user.id))
+
+    return {"ip": by_ip, "session": by_session, "user": by_user}[by]
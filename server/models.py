@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from sqlalchemy import ForeignKey, String, Integer, DateTime
+from sqlalchemy import ForeignKey, Index, String, Integer, DateTime, Text, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -29,12 +29,16 @@ class User(Base):
 
 class Repository(Base):
     __tablename__ = "repositories"
+    __table_args__ = (Index("ix_repositories_owner_id", "owner_id", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     bucket_addr: Mapped[str | None] = mapped_column(String(255), nullable=True)
     password: Mapped[str] = mapped_column(String(255), nullable=False)
+    key_epoch: Mapped[int] = mapped_column(default=0, server_default="0")
+    # while rotating: the previous epoch's key, wrapped under the current one
+    previous_key: Mapped[str | None] = mapped_column(Text, nullable=True)
 
     # Relationships
     owner = relationship("User", back_populates="repositories")
@@ -48,6 +52,15 @@ class Repository(Base):
 
 class Version(Base):
     __tablename__ = "versions"
+    __table_args__ = (
+        Index(
+            "ix_versions_repository_version",
+            "repository_id",
+            text("version_number DESC"),
+            unique=True,
+        ),
+        Index("ix_versions_created_by", "created_by"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     file_id: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -70,10 +83,21 @@ class Version(Base):
 
 class Env(Base):
     __tablename__ = "envs"
+    __table_args__ = (
+        Index(
+            "ix_envs_repository_stage_key",
+            "repository_id",
+            "stage",
+            "key",
+            unique=True,
+        ),
+        Index("ix_envs_created_by", "created_by"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     key: Mapped[str] = mapped_column(String(255), nullable=False)
-    value: Mapped[str] = mapped_column(String(1000), nullable=False)
+    # sealed, see crypto/envelope
+    value: Mapped[str] = mapped_column(Text, nullable=False)
     stage: Mapped[str] = mapped_column(String(50), nullable=False)
     repository_id: Mapped[int] = mapped_column(
         ForeignKey("repositories.id"), nullable=False
@@ -0,0 +1,75 @@
+import base64
+import json
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+@dataclass(slots=True)
+class Page[T]:
+    items: list[T]
+    next_cursor: str | None
+
+
+def clamp_limit(limit: int | None, default: int, maximum: int) -> int:
+    if limit is None:
+        return default
+
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(kind: str, position: list[Any]) -> str:
+    """
+    An opaque token for "the page after `position`", the sort key of the last
+    item returned. `kind` ties it to one listing, a cursor from another is
+    rejected instead of silently paging from the wrong place.
+    """
+    data = json.dumps([kind, position], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode_cursor(kind: str, cursor: str, types: tuple[type, ...]) -> list[Any]:
+    """
+    returns the position encoded in `cursor`, raises ValueError if it isn't a
+    `kind` cursor or its position doesn't match `types`, the type of each of
+    its values. Cursors come from clients, a forged one must not reach the
+    query.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_kind, position = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"malformed cursor: {e}")
+
+    if cursor_kind != kind or not isinstance(position, list):
+        raise ValueError(f"not a {kind} cursor")
+    if len(position) != len(types) or not all(
+        _is_a(value, t) for value, t in zip(position, types)
+    ):
+        raise ValueError(f"malformed {kind} cursor")
+
+    return position
+
+
+def _is_a(value: Any, t: type) -> bool:
+    if t is int:
+        # bool is an int too, and postgres integers are at most 64 bits
+        return type(value) is int and -(2**63) <= value < 2**63
+
+    return isinstance(value, t)
+
+
+def make_page[T](
+    kind: str,
+    rows: list[T],
+    limit: int,
+    position: Callable[[T], list[Any]],
+) -> Page[T]:
+    """
+    Builds a page from up to `limit + 1` rows, the extra row only telling
+    whether there is a next page.
+    """
+    if len(rows) <= limit:
+        return Page(rows, None)
+
+    rows = rows[:limit]
+    return Page(rows, encode_cursor(kind, position(rows[-1])))
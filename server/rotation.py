@@ -0,0 +1,276 @@
+import asyncio
+import time
+from dataclasses import asdict
+from typing import Any, AsyncIterator
+import anyio
+from blake3 import blake3
+from fastapi import HTTPException, status
+from loguru import logger
+from . import cache, database as db
+from .config import EVAULT_ROTATION_BATCH_SIZE, EVAULT_ROTATION_BATCH_DELAY
+from .crypto import envelope, hashing, keystore
+from .crypto.keyring import zeroize
+from .crypto.keystore import RepositoryKeys
+from .models import Env, Version
+from .storage import BlobNotFound
+from .storage.backend import get_blob_store
+from .types import RepositoryInfo, RotationProgress
+
+# the worker holding a rotation extends its lock with every batch. one that
+# stops, e.g. killed, lets the rotation be resumed after this many seconds.
+_LOCK_TTL = 60.0
+
+# this worker's running rotations, by repository
+_tasks: dict[int, asyncio.Task] = {}
+
+
+class _LockLost(Exception):
+    pass
+
+
+async def start(
+    repo: RepositoryInfo,
+    password: str,
+    new_password: str | None,
+) -> int:
+    """
+    Moves the repository to a new key epoch, derived from `new_password` if
+    given, and re-seals everything to it in the background. Resumes the
+    rotation in progress instead, if there is one. returns the new epoch.
+    raises 403 on a wrong password, 409 if the repository changed meanwhile.
+    """
+    keys = await keystore.unlock(repo, password)
+    if len(keys.keys) > 1:
+        if new_password is not None:
+            keys.wipe()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A key rotation is in progress.",
+            )
+        _spawn(repo.id, keys)
+        return keys.epoch
+
+    with keys:
+        epoch = keys.epoch + 1
+        next_password = new_password if new_password is not None else password
+        keyring = keystore.get_keyring()
+        new_key = keyring.derive(repo.id, epoch, next_password)
+        wrapped = envelope.wrap_key(new_key, epoch, repo.id, keys.current)
+        digest = None if new_password is None else await hashing.hash(new_password)
+
+        if not await db.begin_key_rotation(repo.id, epoch, wrapped, digest):
+            zeroize(new_key)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Repository key changed meanwhile, retry.",
+            )
+
+        previous = keyring.put(
+            repo.id, epoch - 1, next_password, bytearray(keys.current)
+        )
+
+    _spawn(repo.id, RepositoryKeys(epoch, {epoch: new_key, epoch - 1: previous}))
+    return epoch
+
+
+async def describe(repo: RepositoryInfo) -> dict[str, Any]:
+    """
+    The repository's key epoch and its last rotation's progress, `stalled`
+    if no worker is at it anymore and it needs resuming.
+    """
+    progress = await cache.get_rotation_progress(repo.id)
+    return {
+        "key_epoch": repo.key_epoch,
+        "rotating": repo.rotating,
+        "stalled": (
+            repo.rotating
+            and (
+                progress is None
+                or progress.state == "failed"
+                or time.time() - progress.updated_at > _LOCK_TTL
+            )
+        ),
+        "progress": asdict(progress) if progress is not None else None,
+    }
+
+
+async def shutdown():
+    """
+    Stops this worker's rotations, they can be resumed from their progress.
+    """
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _spawn(repo_id: int, keys: RepositoryKeys):
+    # takes ownership of `keys`
+    if repo_id in _tasks:
+        keys.wipe()
+        return
+
+    task = asyncio.create_task(_Rotation(repo_id, keys).run())
+    _tasks[repo_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(repo_id, None))
+
+
+class _Rotation:
+    """
+    Re-seals a repository's variables, then its version payloads, to
+    `keys.epoch` in batches of `EVAULT_ROTATION_BATCH_SIZE` rows, pausing
+    `EVAULT_ROTATION_BATCH_DELAY` seconds between batches. Progress is saved
+    to redis after every batch, a resumed rotation picks up from there.
+    Every step is idempotent: rows already at the new epoch are skipped.
+    """
+
+    def __init__(self, repo_id: int, keys: RepositoryKeys):
+        self.repo_id = repo_id
+        self.keys = keys
+        self.token = ""
+        self.progress: RotationProgress | None = None
+
+    async def run(self):
+        with self.keys:
+            token = await cache.acquire_rotation_lock(self.repo_id, _LOCK_TTL)
+            if token is None:
+                logger.info(f"Key rotation of {self.repo_id} runs elsewhere")
+                return
+
+            self.token = token
+            try:
+                await self._run()
+            except _LockLost:
+                logger.warning(f"Key rotation of {self.repo_id} lost its lock")
+            except Exception as e:
+                logger.exception(f"Key rotation of {self.repo_id} failed")
+                if self.progress is not None:
+                    self.progress.state = "failed"
+                    self.progress.error = f"{type(e).__name__}: {e}"
+                    await self._save()
+            finally:
+                await cache.release_rotation_lock(self.repo_id, token)
+
+    async def _run(self):
+        progress = await cache.get_rotation_progress(self.repo_id)
+        if progress is None or progress.epoch != self.keys.epoch:
+            envs_total, versions_total = await db.count_repository_rows(self.repo_id)
+            progress = RotationProgress(
+                epoch=self.keys.epoch,
+                state="running",
+                envs_total=envs_total,
+                versions_total=versions_total,
+                started_at=time.time(),
+            )
+        progress.state = "running"
+        progress.error = None
+        self.progress = progress
+        await self._save()
+        logger.info(f"Rotating the key of {self.repo_id} to epoch {progress.epoch}")
+
+        while rows := await db.list_sealed_envs(
+            self.repo_id, EVAULT_ROTATION_BATCH_SIZE, progress.env_cursor
+        ):
+            updates = await anyio.to_thread.run_sync(self._reseal_envs, rows)
+            await db.reseal_envs(updates)
+            progress.envs_done += len(rows)
+            progress.env_cursor = rows[-1].id
+            await self._save()
+            await asyncio.sleep(EVAULT_ROTATION_BATCH_DELAY)
+
+        while versions := await db.list_version_payloads(
+            self.repo_id, EVAULT_ROTATION_BATCH_SIZE, progress.version_cursor
+        ):
+            await self._reseal_payloads(versions)
+            progress.versions_done += len(versions)
+            progress.version_cursor = versions[-1].version_number
+            await self._save()
+            await asyncio.sleep(EVAULT_ROTATION_BATCH_DELAY)
+
+        # pushes share-lock the repository at their epoch, none sealed with
+        # the previous key once the rotation began: nothing is left to re-seal
+        await db.finish_key_rotation(self.repo_id, self.keys.epoch)
+        keystore.get_keyring().forget(self.repo_id, self.keys.epoch - 1)
+        progress.state = "done"
+        await self._save()
+        logger.info(f"Rotated the key of {self.repo_id} to epoch {progress.epoch}")
+
+    def _reseal_envs(self, rows: list[Env]) -> list[tuple[int, str, str]]:
+        stages: dict[str, list[Env]] = {}
+        for row in rows:
+            if envelope.sealed_epoch(row.value) != self.keys.epoch:
+                stages.setdefault(row.stage, []).append(row)
+
+        updates: list[tuple[int, str, str]] = []
+        for stage, stale in stages.items():
+            variables = envelope.open_envs(
+                self.keys.keys, self.repo_id, stage, {r.key: r.value for r in stale}
+            )
+            sealed = envelope.seal_envs(
+                self.keys.current, self.keys.epoch, self.repo_id, stage, variables
+            )
+            updates.extend((r.id, r.value, sealed[r.key]) for r in stale)
+
+        return updates
+
+    async def _reseal_payloads(self, versions: list[Version]):
+        store = get_blob_store()
+        updates: list[tuple[int, str, str]] = []
+        for version in versions:
+            try:
+                if await self._payload_epoch(version.s3_id) == self.keys.epoch:
+                    continue
+            except BlobNotFound:
+                logger.error(f"Missing payload {version.s3_id}, not re-sealed")
+                continue
+
+            # the key is derived from the payload's digest: one pass to hash
+            # it, a second to re-seal it, neither holds the whole payload
+            # pylint: disable=E1102
+            hasher = blake3()
+            async for chunk in self._open_payload(version):
+                hasher.update(chunk)
+            blob = await store.put(
+                envelope.seal_stream(
+                    self.keys.current,
+                    self.keys.epoch,
+                    self.repo_id,
+                    version.file_id,
+                    self._open_payload(version),
+                    hasher.digest(),
+                )
+            )
+            updates.append((version.id, version.s3_id, blob.checksum))
+
+        # old payloads go once nothing points at them. identical payloads are
+        # stored once, versions of later batches may still share one
+        updated = set(await db.repoint_version_payloads(updates))
+        repointed = {old for version_id, old, _ in updates if version_id in updated}
+        referenced = await db.referenced_payloads(self.repo_id, list(repointed))
+        for old in repointed - referenced:
+            await store.delete(old)
+
+    def _open_payload(self, version: Version) -> AsyncIterator[bytes]:
+        return envelope.open_stream(
+            self.keys.keys,
+            self.repo_id,
+            version.file_id,
+            get_blob_store().open(version.s3_id),
+        )
+
+    async def _payload_epoch(self, payload_id: str) -> int:
+        chunks = get_blob_store().open(payload_id)
+        try:
+            head = await anext(chunks, b"")
+        finally:
+            await chunks.aclose()
+
+        return envelope.stream_epoch(head)
+
+    async def _save(self):
+        assert self.progress is not None
+        self.progress.updated_at = time.time()
+        if not await cache.save_rotation_progress(
+            self.repo_id, self.token, self.progress, _LOCK_TTL
+        ):
+            raise _LockLost()
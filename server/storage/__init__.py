@@ -0,0 +1,2 @@
+from .base import BlobInfo, BlobNotFound, BlobStore, iter_chunks
+from .local import LocalBlobStore
@@ -0,0 +1,17 @@
+from ..config import EVAULT_BLOB_BACKEND, EVAULT_BLOB_DIR
+from .base import BlobStore
+from .local import LocalBlobStore
+
+# created on first use
+_store: BlobStore | None = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        match EVAULT_BLOB_BACKEND:
+            case "local":
+                _store = LocalBlobStore(EVAULT_BLOB_DIR)
+
+    assert _store is not None
+    return _store
@@ -0,0 +1,58 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+async def iter_chunks(data: bytes, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """
+    Streams an in-memory payload into `BlobStore.put`.
+    """
+    for i in range(0, len(data), chunk_size):
+        yield data[i : i + chunk_size]
+
+
+@dataclass(slots=True)
+class BlobInfo:
+    checksum: str  # blake3, hex
+    size: int
+    stored: bool  # False if identical content was already stored
+
+
+class BlobStore(ABC):
+    """
+    Content-addressed storage for version payloads: a blob's key is the
+    blake3 digest of its content, so identical payloads are stored once.
+    Blobs are streamed in and out in chunks, never held whole in memory.
+
+    The operations map onto any S3-compatible object store: `put` is an
+    upload to a temporary key followed by a copy to the digest, `open` a
+    ranged GET, `exists` a HEAD and `delete` a DELETE.
+    """
+
+    @abstractmethod
+    async def put(self, chunks: AsyncIterable[bytes]) -> BlobInfo:
+        """
+        Stores the concatenated `chunks`, unless a blob with the same content
+        already exists.
+        """
+
+    @abstractmethod
+    def open(self, checksum: str) -> AsyncIterator[bytes]:
+        """
+        Streams a blob's content, raises `BlobNotFound` on first iteration if
+        there is no such blob.
+        """
+
+    @abstractmethod
+    async def exists(self, checksum: str) -> bool: ...
+
+    @abstractmethod
+    async def delete(self, checksum: str):
+        """
+        Removes a blob, if it exists. Callers make sure no version refers to
+        it anymore.
+        """
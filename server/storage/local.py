@@ -0,0 +1,75 @@
+import os
+import re
+import secrets
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator
+import anyio
+import blake3
+from .base import BlobInfo, BlobNotFound, BlobStore
+
+_CHUNK_SIZE = 64 * 1024
+_CHECKSUM = re.compile(r"^[0-9a-f]{64}$")
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs as files under `root`, fanned out by digest prefix:
+    `root/ab/cd/abcd...`. Uploads are written to `root/tmp` and renamed into
+    place once complete, so a blob is either absent or whole, even with
+    concurrent uploads of the same content.
+    """
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self._tmp = self.root / "tmp"
+
+    async def put(self, chunks: AsyncIterable[bytes]) -> BlobInfo:
+        await anyio.Path(self._tmp).mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp / secrets.token_hex(16)
+        # pylint: disable=E1102
+        hasher = blake3.blake3()
+        size = 0
+
+        try:
+            async with await anyio.open_file(tmp, "wb") as f:
+                async for chunk in chunks:
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    await f.write(chunk)
+                await f.flush()
+                await anyio.to_thread.run_sync(os.fsync, f.wrapped.fileno())
+
+            checksum = hasher.hexdigest()
+            path = anyio.Path(self._path(checksum))
+            if await path.exists():
+                await anyio.Path(tmp).unlink()
+                return BlobInfo(checksum, size, stored=False)
+
+            await path.parent.mkdir(parents=True, exist_ok=True)
+            await anyio.Path(tmp).replace(path)
+            return BlobInfo(checksum, size, stored=True)
+        except BaseException:
+            await anyio.Path(tmp).unlink(missing_ok=True)
+            raise
+
+    async def open(self, checksum: str) -> AsyncIterator[bytes]:
+        try:
+            f = await anyio.open_file(self._path(checksum), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(checksum)
+
+        async with f:
+            while chunk := await f.read(_CHUNK_SIZE):
+                yield chunk
+
+    async def exists(self, checksum: str) -> bool:
+        return await anyio.Path(self._path(checksum)).exists()
+
+    async def delete(self, checksum: str):
+        await anyio.Path(self._path(checksum)).unlink(missing_ok=True)
+
+    def _path(self, checksum: str) -> Path:
+        if not _CHECKSUM.match(checksum):
+            raise BlobNotFound(checksum)
+
+        return self.root / checksum[:2] / checksum[2:4] / checksum
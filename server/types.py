@@ -1,4 +1,5 @@
 from dataclasses import asdict, dataclass
+import struct
 import flatten_dict
 from pydantic import BaseModel
 from typing import Dict, Literal
@@ -14,14 +15,14 @@ class AuthDataDevice:
     interval: int
 
 
-@dataclass
+@dataclass(slots=True)
 class GithubAuthToken:
     access_token: str
     token_type: str
     scope: str
 
 
-@dataclass
+@dataclass(slots=True)
 class GitHubUser:
     id: int
     name: str
@@ -32,8 +33,17 @@ class GitHubUser:
 
 _FLATTEN_DICT_REDUCER = "dot"
 
+# binary session layout, all integers big endian:
+#   u8 version | u8 flags | i64 user.id | (u16 length, utf-8 bytes) * n
+# the strings follow _SESSION_STRING_FIELDS, then the csrf token if flagged.
+_SESSION_CODEC_VERSION = 1
+_SESSION_HEADER = struct.Struct(">BBq")
+_SESSION_STRLEN = struct.Struct(">H")
+_SESSION_FLAG_CLI = 0b01
+_SESSION_FLAG_CSRF = 0b10
 
-@dataclass
+
+@dataclass(slots=True)
 class UserSession:
     device_type: DeviceType
     user: GitHubUser
@@ -62,6 +72,132 @@ class UserSession:
 
         return flatten_dict.flatten(m, reducer=_FLATTEN_DICT_REDUCER)
 
+    def encode(self) -> bytes:
+        flags = 0
+        if self.device_type == "cli":
+            flags |= _SESSION_FLAG_CLI
+
+        fields = [
+            self.user.name,
+            self.user.login,
+            self.user.type,
+            self.user.avatar_url,
+            self.gh_token.access_token,
+            self.gh_token.token_type,
+            self.gh_token.scope,
+        ]
+        if self.csrf_token is not None:
+            flags |= _SESSION_FLAG_CSRF
+            fields.append(self.csrf_token)
+
+        out = [_SESSION_HEADER.pack(_SESSION_CODEC_VERSION, flags, self.user.id)]
+        for field in fields:
+            b = field.encode()
+            out.append(_SESSION_STRLEN.pack(len(b)))
+            out.append(b)
+
+        return b"".join(out)
+
+    @staticmethod
+    def decode(data: bytes) -> "UserSession":
+        """
+        Inverse of `encode`.
+        raises `ValueError` if the data is not a (supported) encoded session.
+        """
+        if len(data) < _SESSION_HEADER.size:
+            raise ValueError("truncated session")
+
+        version, flags, user_id = _SESSION_HEADER.unpack_from(data)
+        if version != _SESSION_CODEC_VERSION:
+            raise ValueError(f"unsupported session encoding v{version}")
+
+        n = 8 if flags & _SESSION_FLAG_CSRF else 7
+        fields: list[str] = []
+        offset = _SESSION_HEADER.size
+        for _ in range(n):
+            end = offset + _SESSION_STRLEN.size
+            if end > len(data):
+                raise ValueError("truncated session")
+
+            (length,) = _SESSION_STRLEN.unpack_from(data, offset)
+            offset, end = end, end + length
+            if end > len(data):
+                raise ValueError("truncated session")
+
+            fields.append(data[offset:end].decode())
+            offset = end
+
+        return UserSession(
+            device_type="cli" if flags & _SESSION_FLAG_CLI else "web",
+            user=GitHubUser(
+                id=user_id,
+                name=fields[0],
+                login=fields[1],
+                type=fields[2],
+                avatar_url=fields[3],
+            ),
+            gh_token=GithubAuthToken(
+                access_token=fields[4],
+                token_type=fields[5],
+                scope=fields[6],
+            ),
+            csrf_token=fields[7] if n == 8 else None,
+        )
+
+
+@dataclass(slots=True)
+class SessionInfo:
+    id: str
+    device_type: DeviceType
+    created_at: int
+    expires_in: int
+
+
+@dataclass(slots=True)
+class RepositoryInfo:
+    """
+    What the dashboard needs to know about a repository, never its password.
+    """
+
+    id: int
+    name: str
+    owner_id: int
+    bucket_addr: str | None
+    key_epoch: int = 0
+    # whether values sealed at the previous key epoch may remain
+    rotating: bool = False
+
+
+@dataclass(slots=True)
+class RotationProgress:
+    """
+    Where a repository's key rotation is at: envs and version payloads are
+    re-sealed in batches, in id and version order, from the cursors on.
+    """
+
+    epoch: int
+    state: Literal["running", "done", "failed"]
+    envs_total: int
+    versions_total: int
+    envs_done: int = 0
+    versions_done: int = 0
+    env_cursor: int | None = None
+    version_cursor: int | None = None
+    started_at: float = 0.0
+    updated_at: float = 0.0
+    error: str | None = None
+
 
 class RequestCookieBase(BaseModel):
     evault_access_token: str
+
+
+class EnvPush(BaseModel):
+    variables: Dict[str, str]
+    description: str = ""
+
+
+class KeyRotation(BaseModel):
+    # rotates to a key derived from a new password, or a fresh one from the
+    # same password if None
+    new_password: str | None = None
@@ -1,4 +1,9 @@
+import asyncio
+import json
 import os
+import random
+import blake3
+from typing import Awaitable, Callable
 
 
 def env_or_default(key: str, default_value: str) -> str:
@@ -10,3 +15,53 @@ def env_or_default(key: str, default_value: str) -> str:
         )
         return default_value
     return value
+
+
+def parse_rate(rate: str) -> tuple[int, float]:
+    """
+    Parses a "<limit>/<seconds>" rate, e.g. "30/60" for 30 per minute.
+    """
+    limit, _, window = rate.partition("/")
+    parsed = (int(limit), float(window))
+    if parsed[0] <= 0 or parsed[1] <= 0:
+        raise ValueError(f"invalid rate '{rate}'")
+    return parsed
+
+
+def encode_envs(variables: dict[str, str]) -> bytes:
+    """
+    The canonical encoding of a stage's variables, independent of their order.
+    """
+    return json.dumps(variables, sort_keys=True, separators=(",", ":")).encode()
+
+
+def checksum_envs(variables: dict[str, str]) -> str:
+    """
+    returns the blake3 hex digest of `encode_envs(variables)`, which is also
+    the key of the version's payload in the blob store.
+    """
+    # pylint: disable=E1102
+    return blake3.blake3(encode_envs(variables)).hexdigest()
+
+
+async def retry_with_backoff[T](
+    fn: Callable[[], Awaitable[T]],
+    attempts: int,
+    base_delay: float = 0.1,
+    max_delay: float = 5.0,
+) -> T:
+    """
+    Awaits `fn` until it succeeds, at most `attempts` times, sleeping with a
+    jittered exponential backoff in between. The last error is re-raised if
+    every attempt fails.
+    """
+    assert attempts > 0
+    for attempt in range(attempts):
+        try:
+            return await fn()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+
+            delay = min(max_delay, base_delay * 2**attempt)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
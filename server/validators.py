@@ -7,3 +7,13 @@ def valid_user_repo_string(user_user: str) -> bool:
     # Cannot start or end with hyphen, cannot have consecutive hyphens
     pattern = re.compile(r"^(?!-)(?!.*--)[a-zA-Z0-9-]{1,39}(?<!-)/[a-zA-Z0-9._-]+$")
     return bool(re.match(pattern, user_user))
+
+
+def valid_stage(stage: str) -> bool:
+    """valid_stage checks a stage name, e.g. "production", "dev_2"."""
+    return bool(re.fullmatch(r"[a-zA-Z0-9_-]{1,50}", stage))
+
+
+def valid_env_key(key: str) -> bool:
+    """valid_env_key checks an environment variable name, e.g. "DATABASE_URL"."""
+    return len(key) <= 255 and bool(re.fullmatch(r"[a-zA-Z_][a-zA-Z0-9_]*", key))
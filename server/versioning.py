@@ -0,0 +1,117 @@
+import json
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Literal
+
+type PayloadKind = Literal["snapshot", "delta"]
+
+_PAYLOAD_VERSION = 1
+
+
+@dataclass(slots=True)
+class VersionPayload:
+    """
+    What a version stores: either the stage's full variables (a snapshot), or
+    the keys set and unset since its `base` version (a delta). `depth` counts
+    the deltas between this version and the snapshot it builds on.
+    """
+
+    kind: PayloadKind
+    base: int | None = None
+    depth: int = 0
+    set: dict[str, str] = field(default_factory=dict)
+    unset: list[str] = field(default_factory=list)
+
+    def encode(self) -> bytes:
+        return json.dumps(
+            {
+                "v": _PAYLOAD_VERSION,
+                "kind": self.kind,
+                "base": self.base,
+                "depth": self.depth,
+                "set": self.set,
+                "unset": self.unset,
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+        ).encode()
+
+    @staticmethod
+    def decode(data: bytes) -> "VersionPayload":
+        """
+        raises ValueError if `data` isn't a payload.
+        """
+        try:
+            d = json.loads(data)
+            if d["v"] != _PAYLOAD_VERSION or d["kind"] not in ("snapshot", "delta"):
+                raise ValueError(f"unknown payload {d['v']}/{d['kind']}")
+
+            return VersionPayload(
+                kind=d["kind"],
+                base=d["base"],
+                depth=d["depth"],
+                set=d["set"],
+                unset=d["unset"],
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"malformed payload: {e}")
+
+
+def make_payload(
+    variables: dict[str, str],
+    previous: dict[str, str] | None,
+    previous_version: int | None,
+    previous_depth: int,
+    snapshot_interval: int,
+) -> VersionPayload:
+    """
+    returns the payload storing `variables` relative to the previous version
+    of the stage, a snapshot if there is none or the delta chain would reach
+    `snapshot_interval`, so materializing any version replays fewer than
+    `snapshot_interval` deltas.
+    """
+    depth = previous_depth + 1
+    if previous is None or previous_version is None or depth >= snapshot_interval:
+        return VersionPayload(kind="snapshot", set=dict(variables))
+
+    return VersionPayload(
+        kind="delta",
+        base=previous_version,
+        depth=depth,
+        set={k: v for k, v in variables.items() if previous.get(k) != v},
+        unset=sorted(previous.keys() - variables.keys()),
+    )
+
+
+def apply(state: dict[str, str], payload: VersionPayload) -> dict[str, str]:
+    """
+    returns the variables after `payload`, `state` being its base's.
+    """
+    if payload.kind == "snapshot":
+        return dict(payload.set)
+
+    out = {k: v for k, v in state.items() if k not in payload.unset}
+    out.update(payload.set)
+    return out
+
+
+async def materialize(
+    version_number: int,
+    load: Callable[[int], Awaitable[VersionPayload]],
+) -> dict[str, str]:
+    """
+    returns the stage's variables at `version_number`, loading payloads back
+    to the nearest snapshot and replaying the deltas forward. raises
+    ValueError on a broken chain.
+    """
+    chain = [await load(version_number)]
+    while chain[-1].kind == "delta":
+        base = chain[-1].base
+        if base is None or len(chain) > chain[0].depth:
+            raise ValueError(f"broken delta chain at version {version_number}")
+        chain.append(await load(base))
+
+    state: dict[str, str] = {}
+    for payload in reversed(chain):
+        state = apply(state, payload)
+
+    return state
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-import time, json
+import time
 from typing import Optional, Tuple
 from urllib.parse import urlencode, urlparse, parse_qs
 import requests, argparse, pathlib
@@ -9,6 +9,8 @@ from server.types import GithubAuthToken, AuthDataDevice, GitHubUser
 
 CREDENTIALS_PATH = pathlib.Path("/tmp/evault-access-token")  # TODO: change this path
 SERVER = "http://127.0.0.1:8000"
+LOGIN_TIMEOUT = 120  # seconds, matches the login link lifetime
+POLL_REQUEST_TIMEOUT = 35  # seconds, longer than the server's polling window
 
 # ARG PARSER
 ALLOW_COMMANDS = ["push", "pull", "check"]
@@ -31,23 +33,20 @@ def get_access_token() -> Optional[str]:
 
     session_id = s[0]
 
-    max_attempts = 10
-    attempt = 0
+    # the server holds each request until the token is issued, or for up to
+    # 25 seconds, so the login completes as soon as the browser is done.
+    poll_url = f"{SERVER}/api/auth/poll/wait?{urlencode({"session_id": session_id})}"
+    deadline = time.monotonic() + LOGIN_TIMEOUT
 
-    poll_url = f"{SERVER}/api/auth/poll?{urlencode({"session_id": session_id})}"
-
-    while attempt <= max_attempts:
-        attempt += 1
-
-        r = session.get(poll_url)
+    while time.monotonic() < deadline:
+        r = session.get(poll_url, timeout=POLL_REQUEST_TIMEOUT)
         if r.status_code == 403 or r.status_code == 440:
             break
 
         assert r.status_code == 200
-        d = json.loads(r.json())
+        d = r.json()
 
         if d.get("status") == "pending":
-            time.sleep(5)
             continue
 
         assert d["status"] == "ok"
@@ -1,5 +1,12 @@
 import sys
+import pytest
 from pathlib import Path
 
 src_path = Path(__file__).parent.parent
 sys.path.insert(0, str(src_path))
+
+
+@pytest.fixture
+def anyio_backend():
+    # the server only runs on asyncio
+    return "asyncio"
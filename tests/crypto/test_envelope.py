@@ -0,0 +1,148 @@
+import base64
+import secrets
+import pytest
+from blake3 import blake3
+from server.crypto.envelope import (
+    EnvelopeError,
+    open_envs,
+    open_stream,
+    seal_envs,
+    seal_stream,
+    sealed_epoch,
+    stream_epoch,
+    unwrap_key,
+    wrap_key,
+)
+from server.storage import iter_chunks
+
+repo_key = secrets.token_bytes(32)
+
+
+async def collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+def seal(key: bytes, epoch: int, repo_id: int, stage: str, payload: bytes):
+    # pylint: disable=E1102
+    digest = blake3(payload).digest()
+    return seal_stream(key, epoch, repo_id, stage, iter_chunks(payload, 1000), digest)
+
+
+def test_seal_and_open_envs():
+    variables = {"A": "1", "B": "", "C": "ünïcode"}
+    sealed = seal_envs(repo_key, 3, 1, "prod", variables)
+
+    assert sealed.keys() == variables.keys()
+    assert "1" not in sealed.values()
+    assert sealed_epoch(sealed["A"]) == 3
+    assert open_envs({3: repo_key}, 1, "prod", sealed) == variables
+
+    # fresh nonces, same plaintext never seals the same
+    assert seal_envs(repo_key, 3, 1, "prod", variables) != sealed
+
+
+def test_open_envs_rejects_moved_values():
+    sealed = seal_envs(repo_key, 0, 1, "prod", {"A": "1", "B": "2"})
+    keys = {0: repo_key}
+
+    with pytest.raises(EnvelopeError):
+        open_envs(keys, 1, "prod", {"A": sealed["B"]})
+    with pytest.raises(EnvelopeError):
+        open_envs(keys, 1, "dev", sealed)
+    with pytest.raises(EnvelopeError):
+        open_envs(keys, 2, "prod", sealed)
+    with pytest.raises(EnvelopeError):
+        open_envs({1: repo_key}, 1, "prod", sealed)
+    with pytest.raises(EnvelopeError):
+        open_envs({0: secrets.token_bytes(32)}, 1, "prod", sealed)
+    with pytest.raises(EnvelopeError):
+        open_envs(keys, 1, "prod", {"A": "plaintext"})
+
+
+def test_open_envs_across_epochs():
+    new_key = secrets.token_bytes(32)
+    sealed = seal_envs(repo_key, 0, 1, "prod", {"A": "1"})
+    sealed |= seal_envs(new_key, 1, 1, "prod", {"B": "2"})
+
+    assert open_envs({0: repo_key, 1: new_key}, 1, "prod", sealed) == {
+        "A": "1",
+        "B": "2",
+    }
+    with pytest.raises(EnvelopeError):
+        open_envs({1: new_key}, 1, "prod", sealed)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("size", [0, 10, 64 * 1024, 200 * 1024 + 3])
+async def test_stream_roundtrip(size):
+    payload = secrets.token_bytes(size)
+    sealed = await collect(seal(repo_key, 0, 1, "prod", payload))
+
+    assert stream_epoch(sealed[:16]) == 0
+    opened = await collect(
+        open_stream({0: repo_key}, 1, "prod", iter_chunks(sealed, chunk_size=777))
+    )
+    assert opened == payload
+
+
+@pytest.mark.anyio
+async def test_stream_rejects_tampering():
+    payload = secrets.token_bytes(150 * 1024)
+    sealed = await collect(seal(repo_key, 0, 1, "prod", payload))
+
+    flipped = bytearray(sealed)
+    flipped[-1] ^= 1
+    truncated = sealed[: 21 + 64 * 1024 + 16]
+
+    for data, stage in [(flipped, "prod"), (truncated, "prod"), (sealed, "dev")]:
+        with pytest.raises(EnvelopeError):
+            await collect(
+                open_stream({0: repo_key}, 1, stage, iter_chunks(bytes(data)))
+            )
+
+
+@pytest.mark.anyio
+async def test_stream_is_deterministic():
+    payload = secrets.token_bytes(100 * 1024)
+    sealed = await collect(seal(repo_key, 0, 1, "prod", payload))
+
+    # same payload, same blob: the blob store keeps it once
+    assert await collect(seal(repo_key, 0, 1, "prod", payload)) == sealed
+
+    other_key = secrets.token_bytes(32)
+    for other in [
+        seal(repo_key, 0, 1, "prod", payload[:-1] + b"x"),
+        seal(repo_key, 0, 1, "dev", payload),
+        seal(repo_key, 0, 2, "prod", payload),
+        seal(repo_key, 1, 1, "prod", payload),
+        seal(other_key, 0, 1, "prod", payload),
+    ]:
+        assert (await collect(other))[21:] != sealed[21:]
+
+
+@pytest.mark.anyio
+async def test_stream_rejects_wrong_digest():
+    payload = secrets.token_bytes(100 * 1024)
+    # pylint: disable=E1102
+    digest = blake3(payload[:-1] + b"x").digest()
+
+    with pytest.raises(EnvelopeError):
+        await collect(seal_stream(repo_key, 0, 1, "prod", iter_chunks(payload), digest))
+
+
+def test_sealed_epoch_rejects_garbage():
+    with pytest.raises(EnvelopeError):
+        sealed_epoch("not sealed")
+    with pytest.raises(EnvelopeError):
+        sealed_epoch(base64.b64encode(b"\x09" * 40).decode())
+
+
+def test_wrap_key():
+    new_key = secrets.token_bytes(32)
+    wrapped = wrap_key(new_key, 1, 7, repo_key)
+
+    assert unwrap_key(new_key, 1, 7, wrapped) == repo_key
+    with pytest.raises(EnvelopeError):
+        unwrap_key(new_key, 1, 8, wrapped)
+    with pytest.raises(EnvelopeError):
+        unwrap_key(repo_key, 1, 7, wrapped)
@@ -0,0 +1,48 @@
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+
+# server.config reads these at import, hashing never touches them
+for name in (
+    "GITHUB_OAUTH_CLIENT_ID",
+    "GITHUB_OAUTH_CLIENT_SECRET",
+    "POSTGRES_USER",
+    "POSTGRES_PASSWORD",
+    "POSTGRES_HOST",
+    "POSTGRES_DBNAME",
+):
+    os.environ.setdefault(name, "test")
+
+from server.crypto import hashing  # noqa: E402
+
+
+def broken(*_):
+    raise BrokenProcessPool()
+
+
+@pytest.mark.anyio
+async def test_stats_count_only_completed_hashes(monkeypatch):
+    pool = ThreadPoolExecutor(1)
+    monkeypatch.setattr(hashing, "_metrics", hashing._HashMetrics())
+    monkeypatch.setattr(hashing, "_get_pool", lambda: pool)
+    monkeypatch.setattr(hashing, "shutdown", lambda: None)
+
+    try:
+        assert await hashing._run(len, "abc") == 3
+
+        with pytest.raises(HTTPException):
+            await hashing._run(broken)
+
+        monkeypatch.setattr(hashing, "EVAULT_HASH_QUEUE_MAX", 0)
+        with pytest.raises(HTTPException):
+            await hashing._run(len, "abc")
+    finally:
+        pool.shutdown()
+
+    stats = hashing.hashing_stats()
+    assert stats["completed"] == 1
+    assert stats["failed"] == 1
+    assert stats["rejected"] == 1
+    assert stats["running"] == stats["waiting"] == 0
@@ -73,3 +73,20 @@ def test_derive_repo_key_different_password_same_repo():
             repo_password=password2,
         )
         assert key1 != key2
+
+
+def test_derive_repo_key_epochs():
+    keys = {
+        derive_repo_key(
+            server_secret=server_secret,
+            repo_id=123,
+            repo_password=password,
+            epoch=epoch,
+        )
+        for epoch in range(16)
+    }
+    assert len(keys) == 16
+
+    # epoch 0 keeps the keys derived before epochs existed
+    key = derive_repo_key(server_secret, 123, password)
+    assert derive_repo_key(server_secret, 123, password, epoch=0) == key
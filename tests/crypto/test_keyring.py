@@ -0,0 +1,54 @@
+import secrets
+from server.crypto.kdf import derive_repo_key
+from server.crypto.keyring import Keyring, wiping
+
+server_secret = secrets.token_bytes(32)
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_keyring_hit_and_miss():
+    keyring = Keyring(server_secret, maxsize=4, ttl=60)
+    assert keyring.get(1, 0, "password") is None
+
+    key = keyring.derive(1, 0, "password")
+    assert bytes(key) == derive_repo_key(server_secret, 1, "password")
+    assert keyring.get(1, 0, "password") == key
+
+    # another password, or epoch, never gets the cached key
+    assert keyring.get(1, 0, "wrong") is None
+    assert keyring.get(1, 1, "password") is None
+
+    stats = keyring.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+
+
+def test_keyring_copies_are_owned_by_the_caller():
+    keyring = Keyring(server_secret, maxsize=4, ttl=60)
+    with wiping(keyring.derive(1, 0, "password")) as key:
+        expected = bytes(key)
+    assert key == bytearray(len(expected))
+
+    assert keyring.get(1, 0, "password") == expected
+
+
+def test_keyring_zeroizes_evicted_keys():
+    timer = FakeTimer()
+    keyring = Keyring(server_secret, maxsize=1, ttl=10, timer=timer)
+    keyring.derive(1, 0, "password")
+    cached = keyring._entries._data[(1, 0)][1].key
+
+    keyring.derive(2, 0, "password")  # pushes repo 1 out
+    assert cached == bytearray(len(cached))
+
+    cached = keyring._entries._data[(2, 0)][1].key
+    timer.now = 10
+    assert keyring.get(2, 0, "password") is None
+    assert cached == bytearray(len(cached))
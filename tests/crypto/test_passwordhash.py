@@ -0,0 +1,16 @@
+from server.crypto import passwordhash
+
+
+def test_hash_and_verify():
+    digest = passwordhash.hash("password")
+    assert digest.startswith("$argon2id$")
+    assert passwordhash.verify(digest, "password")
+    assert not passwordhash.verify(digest, "wrong")
+    assert not passwordhash.verify("not a digest", "password")
+
+
+def test_check_needs_rehash():
+    assert not passwordhash.check_needs_rehash(passwordhash.hash("password"))
+
+    weak = "$argon2id$v=19$m=8,t=1,p=1$c29tZXNhbHQ$Pq1m8HnaTDS0kbmi7WkMNw"
+    assert passwordhash.check_needs_rehash(weak)
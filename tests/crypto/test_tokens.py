@@ -0,0 +1,55 @@
+import secrets
+import pytest
+from server.crypto.tokens import TokenError, UnlockClaims, open_token, seal_token
+
+token_key = secrets.token_bytes(32)
+keys = {3: secrets.token_bytes(32), 2: secrets.token_bytes(32)}
+
+
+def make_claims(**overrides) -> UnlockClaims:
+    claims = UnlockClaims(
+        jti=secrets.token_hex(16),
+        repo_id=1,
+        user_id=2,
+        stage="prod",
+        epoch=3,
+        issued_at=1000,
+        expires_at=1900,
+    )
+    for name, value in overrides.items():
+        setattr(claims, name, value)
+    return claims
+
+
+def test_token_roundtrip():
+    claims = make_claims()
+    token = seal_token(token_key, claims, keys)
+
+    opened, opened_keys = open_token(token_key, token, now=1500)
+    assert opened == claims
+    assert opened_keys == keys
+
+
+def test_token_expiry():
+    token = seal_token(token_key, make_claims(), keys)
+
+    with pytest.raises(TokenError):
+        open_token(token_key, token, now=1900)
+
+
+def test_token_rejects_forgery():
+    token = seal_token(token_key, make_claims(), keys)
+
+    with pytest.raises(TokenError):
+        open_token(secrets.token_bytes(32), token, now=1500)
+    with pytest.raises(TokenError):
+        open_token(token_key, token[:-4], now=1500)
+    with pytest.raises(TokenError):
+        open_token(token_key, "evu1.not-a-token", now=1500)
+
+    # claims are authenticated: moving the token to another stage fails
+    other = seal_token(token_key, make_claims(stage="dev"), keys)
+    prefix = len("evu1.") + 4
+    forged = token[:prefix] + other[prefix : prefix + 50] + token[prefix + 50 :]
+    with pytest.raises(TokenError):
+        open_token(token_key, forged, now=1500)
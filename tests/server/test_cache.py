@@ -0,0 +1,131 @@
+import asyncio
+import os
+import pytest
+from redis.asyncio import RedisCluster, Sentinel
+from redis.asyncio.cluster import ClusterPipeline
+
+# server.config reads these at import, the cache never touches them
+for name in (
+    "GITHUB_OAUTH_CLIENT_ID",
+    "GITHUB_OAUTH_CLIENT_SECRET",
+    "POSTGRES_USER",
+    "POSTGRES_PASSWORD",
+    "POSTGRES_HOST",
+    "POSTGRES_DBNAME",
+):
+    os.environ.setdefault(name, "test")
+
+from server import cache  # noqa: E402
+
+
+@pytest.mark.anyio
+async def test_subscriber_has_no_socket_timeout():
+    subscriber = await cache._make_subscriber()
+    try:
+        kwargs = subscriber.connection_pool.connection_kwargs
+        assert kwargs["socket_timeout"] is None
+        assert kwargs["health_check_interval"] > 0
+    finally:
+        await subscriber.aclose(close_connection_pool=True)
+
+
+@pytest.mark.anyio
+async def test_sentinel_subscriber_has_no_socket_timeout(monkeypatch):
+    sentinel = Sentinel([("localhost", 26379)], socket_timeout=5)
+    monkeypatch.setattr(cache, "_sentinel", sentinel)
+
+    subscriber = await cache._make_subscriber()
+    try:
+        assert subscriber.connection_pool.connection_kwargs["socket_timeout"] is None
+    finally:
+        await subscriber.aclose(close_connection_pool=True)
+
+
+@pytest.fixture
+def published(monkeypatch) -> list[str]:
+    """
+    Runs the cache against a redis cluster client that never connects:
+    pipelines reply 1 to every command, published events are collected.
+    """
+    events: list[str] = []
+
+    async def initialize(self):
+        return self
+
+    async def execute(self, *_, **__):
+        replies = [1] * len(self)
+        await self.reset()
+        return replies
+
+    async def execute_command(self, *args, **_):
+        if args[0] == "PUBLISH":
+            events.append(args[2])
+            return 1
+        assert args[0] == "ZRANGE"
+        return [b"a", b"b"]
+
+    monkeypatch.setattr(RedisCluster, "initialize", initialize)
+    monkeypatch.setattr(RedisCluster, "execute_command", execute_command)
+    monkeypatch.setattr(ClusterPipeline, "execute", execute)
+    monkeypatch.setattr(cache, "_redis", RedisCluster(host="localhost", port=7000))
+    monkeypatch.setattr(cache, "_CLUSTER", True)
+    return events
+
+
+@pytest.mark.anyio
+async def test_cluster_remove_session(published):
+    await cache.remove_session("a", 1)
+    assert published == ["session:a"]
+
+
+@pytest.mark.anyio
+async def test_cluster_revoke_user_sessions(published):
+    assert await cache.revoke_user_sessions(1) == 2
+    assert published == ["session:a", "session:b"]
+
+
+@pytest.mark.anyio
+async def test_cluster_pipeline_publishes_nothing_on_error(published):
+    with pytest.raises(RuntimeError):
+        async with cache._pipeline() as pipe:
+            pipe.delete("a")
+            cache._publish(pipe, "session:a")
+            raise RuntimeError()
+
+    assert published == []
+    assert cache._pending_events == {}
+
+
+@pytest.mark.anyio
+async def test_cluster_token_poll_publishes_after_batch(published):
+    async with cache.batch() as pipe:
+        await cache.cache_token_poll("s", "t", 30, pipe)
+        assert published == []
+
+    assert published == ["token-poll:s"]
+
+
+@pytest.mark.anyio
+async def test_cluster_invalidate_repository(published):
+    await cache.invalidate_repository(7)
+    assert published == ["repo:7"]
+
+
+@pytest.mark.anyio
+async def test_concurrent_token_poll_waiters(monkeypatch):
+    tokens: list[str | None] = [None, None, "token"]
+
+    async def get_token_poll(_):
+        return tokens.pop(0) if tokens else None
+
+    monkeypatch.setattr(cache, "get_token_poll", get_token_poll)
+
+    # the first waiter times out and leaves, the second is still woken up
+    short = asyncio.create_task(cache.wait_token_poll("s", 0.01))
+    long = asyncio.create_task(cache.wait_token_poll("s", 5))
+    assert await short is None
+    await asyncio.sleep(0)
+
+    cache._handle_event(b"token-poll:s")
+    assert await asyncio.wait_for(long, 1) == "token"
+    assert "s" not in cache._token_waiters
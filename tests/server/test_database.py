@@ -0,0 +1,73 @@
+import os
+from types import SimpleNamespace
+import pytest
+
+# server.config reads these at import, nothing connects here
+for name in (
+    "GITHUB_OAUTH_CLIENT_ID",
+    "GITHUB_OAUTH_CLIENT_SECRET",
+    "POSTGRES_USER",
+    "POSTGRES_PASSWORD",
+    "POSTGRES_HOST",
+    "POSTGRES_DBNAME",
+):
+    os.environ.setdefault(name, "test")
+
+from server import database as db  # noqa: E402
+from server.types import RepositoryInfo  # noqa: E402
+
+
+class FakeSession:
+    def __init__(self, row):
+        self.row = row
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    async def get(self, *_):
+        return self.row
+
+
+def repository(key_epoch: int, previous_key: str | None) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=1,
+        name="a/b",
+        owner_id=2,
+        bucket_addr=None,
+        key_epoch=key_epoch,
+        previous_key=previous_key,
+    )
+
+
+@pytest.mark.anyio
+async def test_repository_cache_fill_skips_lagging_replica(monkeypatch):
+    cached: list[RepositoryInfo] = []
+
+    async def get_repository_info(_):
+        return None
+
+    async def cache_repository_info(info):
+        cached.append(info)
+
+    async def usable():
+        return True
+
+    # the replica still has the row from before the rotation began
+    monkeypatch.setattr(db, "PSQL_REPLICA_HOST", "replica")
+    monkeypatch.setattr(db._replica_health, "usable", usable)
+    monkeypatch.setattr(
+        db, "_replica_session", lambda: FakeSession(repository(0, None))
+    )
+    monkeypatch.setattr(db, "_session", lambda: FakeSession(repository(1, "wrapped")))
+    monkeypatch.setattr(db.cache, "get_repository_info", get_repository_info)
+    monkeypatch.setattr(db.cache, "cache_repository_info", cache_repository_info)
+
+    info = await db.get_repository_info(1)
+    assert info is not None and info.key_epoch == 1 and info.rotating
+    assert cached == [info]
+
+    # other reads still go to the replica
+    assert (await db.get_repository(1)).key_epoch == 0
@@ -0,0 +1,59 @@
+from server.lru import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_hit_miss():
+    c = TTLCache(maxsize=2, ttl=10)
+    assert c.get("a") is None
+    c.put("a", 1)
+    assert c.get("a") == 1
+    assert c.hits == 1
+    assert c.misses == 1
+
+
+def test_ttl_cache_expiry():
+    timer = FakeTimer()
+    c = TTLCache(maxsize=2, ttl=10, timer=timer)
+    c.put("a", 1)
+
+    timer.now = 9.9
+    assert c.get("a") == 1
+
+    timer.now = 10
+    assert c.get("a") is None
+    assert len(c) == 0
+
+
+def test_ttl_cache_lru_bound():
+    evicted = []
+    c = TTLCache(maxsize=2, ttl=10, on_evict=lambda k, v: evicted.append(k))
+    c.put("a", 1)
+    c.put("b", 2)
+    c.get("a")  # "b" is now the least recently used
+    c.put("c", 3)
+
+    assert evicted == ["b"]
+    assert "a" in c
+    assert "c" in c
+    assert "b" not in c
+
+
+def test_ttl_cache_pop_and_clear():
+    evicted = []
+    c = TTLCache(maxsize=4, ttl=10, on_evict=lambda k, v: evicted.append((k, v)))
+    c.put("a", 1)
+    c.put("b", 2)
+    assert c.pop("a") == 1
+    assert c.pop("a") is None
+
+    c.clear()
+    assert evicted == [("a", 1), ("b", 2)]
+    assert len(c) == 0
+    assert c.stats()["evictions"] == 2
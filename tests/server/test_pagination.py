@@ -0,0 +1,45 @@
+import pytest
+from server.pagination import clamp_limit, decode_cursor, encode_cursor, make_page
+
+
+def test_cursor_roundtrip():
+    cursor = encode_cursor("versions", [42])
+    assert "=" not in cursor
+    assert decode_cursor("versions", cursor, (int,)) == [42]
+    assert decode_cursor("keys", encode_cursor("keys", ["DATABASE_URL"]), (str,)) == [
+        "DATABASE_URL"
+    ]
+
+
+def test_cursor_rejects_foreign_and_malformed():
+    with pytest.raises(ValueError):
+        decode_cursor("keys", encode_cursor("versions", [42]), (int,))
+
+    for cursor in ["", "not base64!", encode_cursor("versions", [])[:-3], "e30"]:
+        with pytest.raises(ValueError):
+            decode_cursor("versions", cursor, (int,))
+
+
+def test_cursor_rejects_forged_positions():
+    for position in [[], [1, 2], ["1"], [1.5], [True], [None], [2**63], [[1]]]:
+        with pytest.raises(ValueError):
+            decode_cursor("versions", encode_cursor("versions", position), (int,))
+
+    with pytest.raises(ValueError):
+        decode_cursor("keys", encode_cursor("keys", [1]), (str,))
+
+
+def test_clamp_limit():
+    assert clamp_limit(None, 50, 200) == 50
+    assert clamp_limit(0, 50, 200) == 1
+    assert clamp_limit(1000, 50, 200) == 200
+
+
+def test_make_page():
+    page = make_page("n", [1, 2, 3], 3, lambda n: [n])
+    assert page.items == [1, 2, 3]
+    assert page.next_cursor is None
+
+    page = make_page("n", [1, 2, 3, 4], 3, lambda n: [n])
+    assert page.items == [1, 2, 3]
+    assert decode_cursor("n", page.next_cursor, (int,)) == [3]
@@ -0,0 +1,46 @@
+import blake3
+import pytest
+from server.storage import BlobNotFound, LocalBlobStore, iter_chunks
+
+
+async def read_all(store: LocalBlobStore, checksum: str) -> bytes:
+    return b"".join([chunk async for chunk in store.open(checksum)])
+
+
+@pytest.mark.anyio
+async def test_local_blob_store_roundtrip(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    payload = b"x" * (200 * 1024) + b"tail"
+
+    blob = await store.put(iter_chunks(payload, chunk_size=1000))
+    # pylint: disable=E1102
+    assert blob.checksum == blake3.blake3(payload).hexdigest()
+    assert blob.size == len(payload)
+    assert blob.stored
+
+    assert await store.exists(blob.checksum)
+    assert await read_all(store, blob.checksum) == payload
+
+
+@pytest.mark.anyio
+async def test_local_blob_store_dedup(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    first = await store.put(iter_chunks(b'{"A":"1"}'))
+    second = await store.put(iter_chunks(b'{"A":"1"}'))
+
+    assert first.checksum == second.checksum
+    assert not second.stored
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+
+@pytest.mark.anyio
+async def test_local_blob_store_missing(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    blob = await store.put(iter_chunks(b"payload"))
+    await store.delete(blob.checksum)
+
+    assert not await store.exists(blob.checksum)
+    with pytest.raises(BlobNotFound):
+        await read_all(store, blob.checksum)
+    with pytest.raises(BlobNotFound):
+        await read_all(store, "../../etc/passwd")
@@ -43,3 +43,27 @@ def test_user_session_marshalling():
     s1 = UserSession.from_flat_map(f)
     assert s1 != s
     assert s1.csrf_token == f["csrf_token"]
+
+
+def test_user_session_encoding():
+    s = deepcopy(test_session)
+    assert UserSession.decode(s.encode()) == s
+
+    s.csrf_token = "foobarbaz"
+    assert UserSession.decode(s.encode()) == s
+
+    s.device_type = "cli"
+    s.csrf_token = None
+    s.user.name = "Tëst Üser ✓"
+    assert UserSession.decode(s.encode()) == s
+
+
+def test_user_session_encoding_rejects_bad_input():
+    data = deepcopy(test_session).encode()
+
+    for bad in [b"", data[:5], data[:-1], b"\x02" + data[1:]]:
+        try:
+            UserSession.decode(bad)
+            assert False, f"decoded invalid session: {bad!r}"
+        except ValueError:
+            pass
@@ -0,0 +1,44 @@
+import pytest
+from server.utils import checksum_envs, parse_rate, retry_with_backoff
+
+
+class Flaky:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError(f"attempt {self.calls}")
+        return "ok"
+
+
+@pytest.mark.anyio
+async def test_retry_with_backoff_recovers():
+    fn = Flaky(failures=2)
+    assert await retry_with_backoff(fn, attempts=3, base_delay=0.001) == "ok"
+    assert fn.calls == 3
+
+
+@pytest.mark.anyio
+async def test_retry_with_backoff_gives_up():
+    fn = Flaky(failures=5)
+    with pytest.raises(ConnectionError, match="attempt 3"):
+        await retry_with_backoff(fn, attempts=3, base_delay=0.001)
+    assert fn.calls == 3
+
+
+def test_parse_rate():
+    assert parse_rate("30/60") == (30, 60.0)
+    assert parse_rate("5/0.5") == (5, 0.5)
+    for rate in ("30", "0/60", "30/0", "a/60"):
+        with pytest.raises(ValueError):
+            parse_rate(rate)
+
+
+def test_checksum_envs_ignores_order():
+    a = checksum_envs({"A": "1", "B": "2"})
+    assert a == checksum_envs({"B": "2", "A": "1"})
+    assert a != checksum_envs({"A": "1", "B": "3"})
+    assert len(a) == 64
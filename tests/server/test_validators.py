@@ -1,4 +1,4 @@
-from server.validators import valid_user_repo_string
+from server.validators import valid_env_key, valid_stage, valid_user_repo_string
 
 
 def test_validate_user_repo_string():
@@ -32,3 +32,19 @@ def test_validate_user_repo_string():
         assert not valid_user_repo_string(
             user_repo
         ), f"Failed for invalid input: {user_repo}"
+
+
+def test_valid_stage():
+    for stage in ["production", "dev_2", "pre-release"]:
+        assert valid_stage(stage), f"Failed for valid input: {stage}"
+
+    for stage in ["", "prod/1", "prod stage", "a" * 51, "prod\n"]:
+        assert not valid_stage(stage), f"Failed for invalid input: {stage}"
+
+
+def test_valid_env_key():
+    for key in ["DATABASE_URL", "_PRIVATE", "key1"]:
+        assert valid_env_key(key), f"Failed for valid input: {key}"
+
+    for key in ["", "1KEY", "MY-KEY", "A B", "A=B", "A" * 256, "API_KEY\n"]:
+        assert not valid_env_key(key), f"Failed for invalid input: {key}"
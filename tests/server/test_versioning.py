@@ -0,0 +1,79 @@
+import pytest
+from server.versioning import VersionPayload, apply, make_payload, materialize
+
+
+def test_payload_encoding():
+    payload = VersionPayload(kind="delta", base=3, depth=2, set={"A": "1"}, unset=["B"])
+    assert VersionPayload.decode(payload.encode()) == payload
+
+    for data in [b"{}", b'{"v":2,"kind":"delta"}', b"[]", b"not json"]:
+        with pytest.raises(ValueError):
+            VersionPayload.decode(data)
+
+
+def test_make_payload_delta():
+    previous = {"A": "1", "B": "2", "C": "3"}
+    current = {"A": "1", "B": "changed", "D": "4"}
+    payload = make_payload(current, previous, 7, 0, snapshot_interval=10)
+
+    assert payload.kind == "delta"
+    assert payload.base == 7
+    assert payload.depth == 1
+    assert payload.set == {"B": "changed", "D": "4"}
+    assert payload.unset == ["C"]
+    assert apply(previous, payload) == current
+
+
+def test_make_payload_snapshot():
+    current = {"A": "1"}
+    assert make_payload(current, None, None, 0, 10).kind == "snapshot"
+
+    payload = make_payload(current, {"A": "0"}, 9, 9, snapshot_interval=10)
+    assert payload.kind == "snapshot"
+    assert payload.depth == 0
+    assert apply({"stale": "x"}, payload) == current
+
+
+@pytest.mark.anyio
+async def test_materialize_replays_from_snapshot():
+    history = [
+        {"A": "1"},
+        {"A": "1", "B": "2"},
+        {"B": "2"},
+        {"B": "3", "C": "4"},
+        {"C": "4"},
+    ]
+    payloads: dict[int, VersionPayload] = {}
+    previous, depth = None, 0
+    for n, variables in enumerate(history, start=1):
+        payload = make_payload(variables, previous, n - 1 if n > 1 else None, depth, 3)
+        payloads[n] = payload
+        previous, depth = variables, payload.depth
+
+    assert [payloads[n].kind for n in payloads] == [
+        "snapshot",
+        "delta",
+        "delta",
+        "snapshot",
+        "delta",
+    ]
+
+    loads = []
+
+    async def load(n: int) -> VersionPayload:
+        loads.append(n)
+        return payloads[n]
+
+    for n, variables in enumerate(history, start=1):
+        loads.clear()
+        assert await materialize(n, load) == variables
+        assert len(loads) <= 3
+
+
+@pytest.mark.anyio
+async def test_materialize_broken_chain():
+    async def load(n: int) -> VersionPayload:
+        return VersionPayload(kind="delta", base=n, depth=1)
+
+    with pytest.raises(ValueError):
+        await materialize(5, load)